@@ -0,0 +1,80 @@
+# coding=utf-8
+
+"""Check the cold start time of loading a Gen 5 Pokémon.
+
+Each run starts a new interpreter, imports pypkm and loads one Gen 5
+box record. The median time has to be within the budget, and none of
+the modules that a Gen 5 box record doesn't need (the Gen 4 structs,
+the database, NumPy, the archive readers) may have been imported.
+
+Usage:
+    python benchmarks/import_time.py [--runs N] [--budget MS]
+"""
+
+__author__ = 'Patrick Jacobs <ceolwulf@gmail.com>'
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Construct itself takes most of the budget to import
+BUDGET_MS = 100
+
+UNWANTED = ('pypkm.structs.gen4', 'pypkm.sqlite', 'sqlite3', 'numpy',
+            'tarfile', 'zipfile')
+
+SCRIPT = """
+import json, sys, time
+start = time.time()
+import pypkm
+pypkm.load(gen=5, data='\\x00' * 136)
+elapsed = (time.time() - start) * 1000
+print(json.dumps({
+    'ms': elapsed,
+    'modules': [name for name in sys.modules if sys.modules[name] is not None],
+}))
+"""
+
+def run():
+    "Time one cold start in a new interpreter."
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+    output = subprocess.check_output([sys.executable, '-c', SCRIPT], env=env)
+
+    return json.loads(output)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=9)
+    parser.add_argument('--budget', type=float, default=BUDGET_MS,
+                        help='the most the median may take (ms)')
+    args = parser.parse_args()
+
+    results = [run() for i in range(args.runs)]
+    times = sorted(result['ms'] for result in results)
+    median = times[len(times) // 2]
+
+    print('{:>10} {:>10} {:>10} {:>10}'.format('min', 'median', 'max', 'budget'))
+    print('{:>7.1f} ms {:>7.1f} ms {:>7.1f} ms {:>7.1f} ms'.format(
+        times[0], median, times[-1], args.budget))
+
+    failed = False
+
+    unwanted = sorted(set(UNWANTED).intersection(results[0]['modules']))
+    if unwanted:
+        print('imported without being needed: {}'.format(', '.join(unwanted)))
+        failed = True
+
+    if median > args.budget:
+        print('over budget by {:.1f} ms'.format(median - args.budget))
+        failed = True
+
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,51 @@
+# coding=utf-8
+
+"""Check that resident memory stays flat across many decrypt() calls.
+
+Before the frame history was moved onto each RNG instance, every call
+to crypto.decrypt() leaked its LC RNG frames into a list shared by the
+whole process.
+
+Usage:
+    python benchmarks/memory.py [calls]
+"""
+
+__author__ = 'Patrick Jacobs <ceolwulf@gmail.com>'
+
+import os
+import sys
+import resource
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pypkm.crypto import decrypt
+
+def rss():
+    "Return the resident set size of this process in kilobytes."
+
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * resource.getpagesize() // 1024
+    except IOError:
+        # not on linux, so fall back to the peak resident size
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def main(calls=1000000, checkpoints=10):
+    data = os.urandom(236)
+    interval = max(calls // checkpoints, 1)
+
+    start = rss()
+    print('{:>10} {:>10} {:>10}'.format('calls', 'rss (KB)', 'delta'))
+
+    for i in range(1, calls + 1):
+        decrypt(data)
+        if i % interval == 0:
+            now = rss()
+            print('{:>10} {:>10} {:>+10}'.format(i, now, now - start))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
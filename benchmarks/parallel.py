@@ -0,0 +1,90 @@
+# coding=utf-8
+
+"""Measure how convert() scales with the number of worker processes.
+
+The same corpus is converted with 1, 2, 4, ... workers (up to the
+number of CPUs, or --max-processes), and each run's throughput is
+compared with a single worker's. Perfect scaling has an efficiency of
+100%; the pool's overhead (and sending records between processes)
+shows up as the efficiency drops.
+
+Usage:
+    python benchmarks/parallel.py [--records N] [--conversion NAME]
+                                  [--max-processes N] [--chunksize N]
+"""
+
+__author__ = 'Patrick Jacobs <ceolwulf@gmail.com>'
+
+import os
+import sys
+import argparse
+import multiprocessing
+from timeit import default_timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pypkm
+from pypkm.bench import corpus
+from pypkm.parallel import convert, CONVERSIONS
+
+def process_counts(maximum):
+    "Return 1, 2, 4, ... up to maximum (always including it)."
+
+    counts = []
+    count = 1
+
+    while count < maximum:
+        counts.append(count)
+        count *= 2
+    counts.append(maximum)
+
+    return counts
+
+def records_for(gen, count, conversion):
+    """Return the records a conversion takes: box data, or GTS server
+    data for topkm().
+
+    Keyword arguments:
+    gen (int) -- the game generation
+    count (int) -- the number of records
+    conversion (str) -- one of CONVERSIONS
+    """
+
+    records = corpus(gen, count)
+    if conversion != 'topkm':
+        return records
+
+    return [pypkm.load(gen, data).toparty().togtsserver().tostring() for data in records]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--records', type=int, default=5000)
+    parser.add_argument('--gen', type=int, choices=[4, 5], default=4)
+    parser.add_argument('--conversion', choices=CONVERSIONS, default='toparty')
+    parser.add_argument('--max-processes', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--chunksize', type=int, default=64)
+    args = parser.parse_args()
+
+    if args.conversion == 'togen5' and args.gen != 4:
+        parser.error('togen5 converts Gen 4 records')
+
+    records = records_for(args.gen, args.records, args.conversion)
+
+    print('{:>9} {:>12} {:>9} {:>11}'.format('processes', 'records/s', 'speedup', 'efficiency'))
+
+    baseline = None
+    for processes in process_counts(args.max_processes):
+        start = default_timer()
+        for data in convert(records, args.gen, args.conversion, processes=processes,
+                            chunksize=args.chunksize):
+            pass
+        rate = len(records) / (default_timer() - start)
+
+        if baseline is None:
+            baseline = rate
+        speedup = rate / baseline
+        print('{:>9} {:>12.0f} {:>8.2f}x {:>10.0%}'.format(
+            processes, rate, speedup, speedup / processes))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# coding=utf-8
+
+"""Compare toparty() with the old build and re-parse round trip.
+
+toparty() used to build the box data, pad it with zeros, parse the
+result as a party Pokémon and then set the level and each stat on it.
+It now appends the battle block to the box data directly.
+
+Usage:
+    python benchmarks/toparty.py [records]
+"""
+
+__author__ = 'Patrick Jacobs <ceolwulf@gmail.com>'
+
+import os
+import sys
+import random
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pypkm.pkm import Gen4BoxPkm, Gen4PartyPkm, set_backend
+from pypkm.sqlite import get_level, get_nature, get_basestats
+from pypkm.util import calcstat
+
+def roundtrip_toparty(obj):
+    "The old toparty(), for comparison."
+
+    data = ''.join([obj.tostring()[:136], '\x00' * 100])
+    new_pkm = Gen4PartyPkm(data)
+
+    new_pkm.level = get_level(pokemon_id=new_pkm.id, exp=new_pkm.exp)
+    nature = get_nature(new_pkm.pv % 25)
+    base_stats = get_basestats(pokemon_id=new_pkm.id)
+
+    new_pkm.stats.current_hp = calcstat(iv=new_pkm.ivs.hp, ev=new_pkm.evs.hp,
+                                        base=base_stats[0], level=new_pkm.level,
+                                        nature_stat=None)
+    new_pkm.stats.max_hp = new_pkm.stats.current_hp
+    for (i, stat) in enumerate(('attack', 'defense', 'speed', 'spattack', 'spdefense')):
+        setattr(new_pkm.stats, stat, calcstat(iv=getattr(new_pkm.ivs, stat),
+                                              ev=getattr(new_pkm.evs, stat),
+                                              base=base_stats[i + 1],
+                                              level=new_pkm.level,
+                                              nature_stat=nature[i + 2]))
+
+    return new_pkm
+
+def records(count):
+    "Make some box Pokémon with random species, experience and IVs."
+
+    rand = random.Random(0)
+    objs = []
+
+    for i in range(count):
+        obj = Gen4BoxPkm()
+        obj.id = rand.randint(1, 386)
+        obj.pv = rand.getrandbits(32)
+        obj.exp = rand.randint(0, 100000)
+        for stat in ('hp', 'attack', 'defense', 'speed', 'spattack', 'spdefense'):
+            setattr(obj.ivs, stat, rand.randint(0, 31))
+        objs.append(obj)
+
+    return objs
+
+def main(count=1000):
+    print('{:>10} {:>14} {:>14} {:>8}'.format('backend', 'round trip', 'single pass', 'speedup'))
+
+    for backend in ('construct', 'compiled'):
+        set_backend(backend)
+        objs = records(count)
+
+        # one warm-up pass, so the lookup tables are already loaded
+        for obj in objs[:10]:
+            roundtrip_toparty(obj).tostring()
+            obj.toparty().tostring()
+
+        old = min(timeit.repeat(lambda: [roundtrip_toparty(obj) for obj in objs],
+                                number=1, repeat=3)) / count
+        new = min(timeit.repeat(lambda: [obj.toparty() for obj in objs],
+                                number=1, repeat=3)) / count
+
+        print('{:>10} {:>11.1f} us {:>11.1f} us {:>7.1f}x'.format(
+            backend, old * 1e6, new * 1e6, old / new))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
@@ -33,15 +33,18 @@ __author__ = 'Patrick Jacobs <ceolwulf@gmail.com>'
 __version__ = '0.5'
 
 from pypkm.pkm import get_pkmobj
+from pypkm.loader import iter_load
 
-def load(gen, data):
+def load(gen, data, lazy=False):
     """Load PKM data.
 
     Keyword arguments:
     gen (int) -- the file's game generation
     data (str) -- the file's binary data
+    lazy (bool) -- only parse fields as they're read (useful when
+        only reading a few fields from many files)
     """
-    return get_pkmobj(gen, data)
+    return get_pkmobj(gen, data, lazy)
 
 def new(gen):
     """Create a new PKM file.
@@ -5,43 +5,25 @@
 __author__ = 'Patrick Jacobs <ceolwulf@gmail.com>'
 
 from construct import Adapter
-from pypkm.sqlite import get_chr, get_ord
+from pypkm.textcodec import NAME
 
 class PkmStringAdapter(Adapter):
     def _encode(self, obj, ctx):
-        """Converts a unicode string to a list of Gen 4 ords."""
+        """Converts a unicode string to Gen 4 character data."""
 
         # enforce unicode
         if not isinstance(obj, unicode):
             obj = obj.decode('utf8')
 
-        ordlist = []
-
-        for chr_ in obj:
-            ord_ = get_ord(chr_)
-            if ord_ == 0xFFFF:
-                break
-            ordlist.append(ord_)
-        
-        while len(ordlist) < (self.bytes - 1):
-            ordlist.append(0xFFFF)
-        
-        ordlist = ordlist[:(self.bytes - 1)]
-        ordlist.append(0xFFFF) # enforce term byte
-
-        return ordlist
+        data = obj.encode(NAME)[:((self.bytes - 1) * 2)]
+
+        # pad with terminators, which also enforces the term byte
+        return data.ljust(self.bytes * 2, '\xff')
     
     def _decode(self, obj, ctx):
-        """Converts a list of Gen 4 ords to a unicode string."""
-
-        chrlist = []
+        """Converts Gen 4 character data to a unicode string."""
 
-        for ord_ in obj:
-            if ord_ == 0xFFFF:
-                break
-            chrlist.append(get_chr(ord_))
-        
-        return ''.join(chrlist)
+        return obj.decode(NAME)
 
 class NicknameAdapter(PkmStringAdapter):
     bytes = 11
@@ -0,0 +1,252 @@
+# coding=utf-8
+
+"""Benchmark loading, building, encryption and every conversion.
+
+Each benchmark runs one operation on every record of a synthetic
+corpus (generated from a fixed seed, so every run uses the same data)
+and reports the throughput and per-call latency percentiles. Results
+are written as JSON and can be compared against an earlier run:
+
+    $ python -m pypkm.bench --output baseline.json
+    $ (make some changes)
+    $ python -m pypkm.bench --baseline baseline.json --threshold 0.1
+
+The comparison exits with status 1 if any benchmark's throughput fell
+by more than the threshold (a fraction of the baseline).
+
+Usage:
+    python -m pypkm.bench [--records N] [--gen 4 5] [--only NAME ...]
+                          [--backend construct|compiled]
+                          [--output FILE] [--baseline FILE] [--threshold T]
+"""
+
+__author__ = 'Patrick Jacobs <ceolwulf@gmail.com>'
+
+import sys
+import json
+import random
+import argparse
+import platform
+from timeit import default_timer
+import pypkm
+from pypkm import crypto, pkm
+from pypkm.sqlite import get_refdata
+from pypkm.util import STATS
+
+# The highest national dex ID of each generation
+SPECIES = {4: 493, 5: 649}
+
+PERCENTILES = (50, 90, 99)
+
+def corpus(gen, count, seed=0):
+    """Create `count` box records with random (but repeatable) species,
+    experience, PV, trainer, IVs, EVs and moves.
+
+    Keyword arguments:
+    gen (int) -- the game generation
+    count (int) -- the number of records
+    seed (int) -- the random seed
+    """
+
+    rand = random.Random(seed)
+    growth_rates = get_refdata().growth_rates
+    # toparty() needs a growth rate for the species
+    species = [i for i in range(1, SPECIES[gen] + 1) if growth_rates.get(i) is not None]
+    records = []
+
+    for i in range(count):
+        obj = pypkm.new(gen)
+        obj.pv = rand.getrandbits(32)
+        obj.id = rand.choice(species)
+        obj.exp = rand.randint(0, 1000000)
+        obj.ot_id = rand.getrandbits(16)
+        obj.ot_secret_id = rand.getrandbits(16)
+        for stat in STATS:
+            setattr(obj.ivs, stat, rand.randint(0, 31))
+            setattr(obj.evs, stat, rand.randint(0, 85))
+        obj.moves.move1 = rand.randint(1, 467)
+        records.append(obj.tostring())
+
+    return records
+
+def percentile(times, percent):
+    "Return a percentile of sorted times (nearest rank)."
+
+    index = int(round((percent / 100.0) * (len(times) - 1)))
+
+    return times[index]
+
+def measure(func, args):
+    """Call func once per argument, timing each call.
+
+    Returns the throughput and latency statistics (in microseconds).
+
+    Keyword arguments:
+    func (function) -- the operation to time
+    args (list) -- one argument per call
+    """
+
+    times = []
+
+    for arg in args:
+        start = default_timer()
+        func(arg)
+        times.append(default_timer() - start)
+
+    total = sum(times)
+    times.sort()
+
+    result = {
+        'calls': len(times),
+        'records_per_sec': len(times) / total if total else 0.0,
+        'mean_us': (total / len(times)) * 1e6,
+    }
+    for percent in PERCENTILES:
+        result['p{}_us'.format(percent)] = percentile(times, percent) * 1e6
+
+    return result
+
+def _edited(gen, data):
+    "Load a record and set a field, so tostring() has work to do."
+
+    obj = pypkm.load(gen, data)
+    obj.item = 234
+
+    return obj
+
+def benchmarks(gen, records):
+    """Return (name, function, arguments) for each benchmark.
+
+    The arguments are prepared here, so only the operation itself is
+    timed.
+
+    Keyword arguments:
+    gen (int) -- the game generation
+    records (list) -- box records from corpus()
+    """
+
+    boxes = [pypkm.load(gen, data) for data in records]
+    parties = [obj.toparty() for obj in boxes]
+    party_data = [obj.tostring() for obj in parties]
+    encrypted = [crypto.encrypt(data) for data in party_data]
+    encrypted_gts = [crypto.encrypt_gts(data) for data in party_data]
+    servers = [pypkm.load(gen, obj.togtsserver().tostring()) for obj in parties]
+
+    yield ('load', lambda data: pypkm.load(gen, data), records)
+    yield ('new', lambda i: pypkm.new(gen), range(len(records)))
+    yield ('tostring', lambda obj: obj.tostring(),
+           [_edited(gen, data) for data in records])
+    yield ('encrypt', crypto.encrypt, party_data)
+    yield ('decrypt', crypto.decrypt, encrypted)
+    yield ('encrypt_gts', crypto.encrypt_gts, party_data)
+    yield ('decrypt_gts', crypto.decrypt_gts, encrypted_gts)
+    yield ('toparty', lambda obj: obj.toparty(), boxes)
+    yield ('togtsserver', lambda obj: obj.togtsserver(), parties)
+    yield ('togtsclient', lambda obj: obj.togtsclient(), parties)
+    if gen == 4:
+        yield ('togen5', lambda obj: obj.togen5(), boxes)
+    yield ('topkm', lambda obj: obj.topkm(), servers)
+
+def run(gens=(4, 5), count=200, only=None, seed=0):
+    """Run the benchmarks and return their results, keyed by
+    'gen<n>.<name>'.
+
+    Keyword arguments:
+    gens (tuple) -- the generations to benchmark
+    count (int) -- the number of records in each corpus
+    only (list) -- the names of the benchmarks to run (default: all)
+    seed (int) -- the corpus seed
+    """
+
+    results = {}
+
+    for gen in gens:
+        records = corpus(gen, count, seed)
+        for (name, func, args) in benchmarks(gen, records):
+            if only and name not in only:
+                continue
+            results['gen{}.{}'.format(gen, name)] = measure(func, args)
+
+    return results
+
+def compare(results, baseline, threshold):
+    """Compare results with a baseline run.
+
+    Returns (name, baseline rate, current rate, change, regressed)
+    for every benchmark in both runs. A benchmark has regressed if its
+    throughput dropped by more than `threshold` (a fraction).
+
+    Keyword arguments:
+    results (dict) -- from run()
+    baseline (dict) -- an earlier run()
+    threshold (float) -- the allowed drop, e.g. 0.1 for 10%
+    """
+
+    rows = []
+
+    for name in sorted(set(results).intersection(baseline)):
+        before = baseline[name]['records_per_sec']
+        after = results[name]['records_per_sec']
+        change = (after - before) / before if before else 0.0
+        rows.append((name, before, after, change, change < -threshold))
+
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pypkm.bench',
+                                     description=__doc__.split('\n')[0])
+    parser.add_argument('--records', type=int, default=200,
+                        help='records in each corpus')
+    parser.add_argument('--gen', type=int, nargs='+', default=[4, 5],
+                        choices=[4, 5])
+    parser.add_argument('--only', nargs='+', metavar='NAME',
+                        help='only run these benchmarks (e.g. load toparty)')
+    parser.add_argument('--backend', choices=['construct', 'compiled'],
+                        default='construct')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', metavar='FILE', help='write the results as JSON')
+    parser.add_argument('--baseline', metavar='FILE', help='compare with earlier results')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='the throughput drop that counts as a regression')
+    args = parser.parse_args(argv)
+
+    pkm.set_backend(args.backend)
+    results = run(args.gen, args.records, args.only, args.seed)
+
+    print('{:<18} {:>12} {:>10} {:>10} {:>10}'.format(
+        'benchmark', 'records/s', 'p50 (us)', 'p90 (us)', 'p99 (us)'))
+    for name in sorted(results):
+        result = results[name]
+        print('{:<18} {:>12.0f} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+            name, result['records_per_sec'], result['p50_us'],
+            result['p90_us'], result['p99_us']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'backend': args.backend,
+                'records': args.records,
+                'seed': args.seed,
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+
+    print('')
+    print('{:<18} {:>12} {:>12} {:>8}'.format('benchmark', 'baseline', 'current', 'change'))
+
+    regressed = False
+    for (name, before, after, change, worse) in compare(results, baseline, args.threshold):
+        print('{:<18} {:>12.0f} {:>12.0f} {:>+7.1%}{}'.format(
+            name, before, after, change, '  REGRESSION' if worse else ''))
+        regressed = regressed or worse
+
+    return 1 if regressed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
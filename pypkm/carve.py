@@ -0,0 +1,151 @@
+# coding=utf-8
+
+"""Find encrypted PKM files inside any binary data.
+
+RAM dumps and damaged save files hold encrypted Pokémon at offsets we
+don't know. scan() tries every offset: the box data at that offset is
+decrypted with the checksum stored in its header, and the offset is
+accepted if the decrypted data adds up to that checksum (and holds a
+valid species).
+
+Most offsets are ruled out before anything is decrypted, because
+bytes 0x04-0x05 of a PKM file are always zero, and a header that's
+all zeroes is an empty slot. The offsets left are decrypted many at a
+time: their keystreams are generated (or read from the keystream
+table, see crypto.enable_keystream_cache()) and XORed as one matrix.
+
+Example usage:
+    >>> from pypkm import carve
+    >>> for (offset, gen, pkm) in carve.scan_file('/path/to/ram.bin', gen=4):
+    ...     print hex(offset), pkm.id
+
+Both generations are encrypted the same way and can't be told apart
+from the data, so the generation has to be given.
+
+NumPy is required for this module.
+"""
+
+__author__ = 'Patrick Jacobs <ceolwulf@gmail.com>'
+
+import mmap
+import numpy
+from pypkm import crypto
+from pypkm.pkm import get_pkmobj
+
+# The highest national dex ID of each generation
+MAX_SPECIES = {4: 493, 5: 649}
+
+# The offsets of the box data bytes within a file
+_box_columns = numpy.arange(0x08, 0x88)
+
+# How many offsets are decrypted at once
+BATCH_SIZE = 0x10000
+
+def _candidates(data, start, stop, alignment):
+    """Return the offsets in [start, stop) that pass the prefilters.
+
+    Keyword arguments:
+    data (numpy.ndarray) -- the bytes being scanned
+    start (int) -- the first offset to try
+    stop (int) -- the offset after the last to try
+    alignment (int) -- only try offsets that are a multiple of this
+    """
+
+    count = stop - start
+    padding = (data[(start + 4):(start + 4 + count)] == 0)
+    padding &= (data[(start + 5):(start + 5 + count)] == 0)
+    offsets = numpy.flatnonzero(padding) + start
+
+    if alignment > 1:
+        offsets = offsets[offsets % alignment == 0]
+
+    # the PV and checksum of an empty slot are zero
+    header = numpy.zeros(len(offsets), dtype=bool)
+    for i in (0, 1, 2, 3, 6, 7):
+        header |= (data[offsets + i] != 0)
+
+    return offsets[header]
+
+def _checksums_match(data, offsets):
+    """Return the offsets whose decrypted box data matches the checksum.
+
+    The checksum is the sum of the box data words, so the blocks don't
+    need to be unshuffled to check it.
+
+    Keyword arguments:
+    data (numpy.ndarray) -- the bytes being scanned
+    offsets (numpy.ndarray) -- the offsets to check
+    """
+
+    seeds = data[offsets + 6].astype(numpy.uint16)
+    seeds |= data[offsets + 7].astype(numpy.uint16) << 8
+
+    box_data = data[offsets[:, None] + _box_columns].view('<u2')
+
+    # there are at most 65,536 keystreams, however many offsets
+    (unique, inverse) = numpy.unique(seeds, return_inverse=True)
+    box_data ^= crypto._box_keystreams(unique)[inverse]
+
+    sums = box_data.sum(axis=1, dtype=numpy.uint32) & 0xFFFF
+
+    return offsets[sums == seeds]
+
+def scan(data, gen, record_size=136, alignment=1, chunk_size=0x1000000):
+    """Find the encrypted PKM files in a buffer.
+
+    Yields (offset, gen, PKM object) in order of offset. Files that
+    would overlap one already found are skipped.
+
+    Keyword arguments:
+    data (str, buffer or mmap) -- the data to scan
+    gen (int) -- the game generation
+    record_size (int) -- 136 for box data, or the party size to also
+        decrypt the battle data after each file
+    alignment (int) -- only try offsets that are a multiple of this
+    chunk_size (int) -- how many offsets to prefilter at once
+    """
+
+    if gen not in MAX_SPECIES:
+        raise ValueError('unsupported generation: {}'.format(gen))
+
+    data = numpy.frombuffer(data, dtype=numpy.uint8)
+    last = len(data) - record_size + 1
+    next_free = 0
+
+    for start in range(0, max(last, 0), chunk_size):
+        offsets = _candidates(data, start, min(start + chunk_size, last), alignment)
+
+        for i in range(0, len(offsets), BATCH_SIZE):
+            for offset in _checksums_match(data, offsets[i:(i + BATCH_SIZE)]):
+                offset = int(offset)
+                if offset < next_free:
+                    continue
+
+                record = data[offset:(offset + record_size)].tostring()
+                pkm = get_pkmobj(gen, crypto.decrypt(record), lazy=True)
+                if not 1 <= pkm.id <= MAX_SPECIES[gen]:
+                    continue
+
+                next_free = offset + record_size
+                yield (offset, gen, pkm)
+
+def scan_file(path, gen, record_size=136, alignment=1):
+    """Find the encrypted PKM files in a file, which is memory-mapped.
+
+    See scan().
+
+    Keyword arguments:
+    path (str) -- the file to scan
+    gen (int) -- the game generation
+    record_size (int) -- 136 for box data, or the party size
+    alignment (int) -- only try offsets that are a multiple of this
+    """
+
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        for result in scan(data, gen, record_size, alignment):
+            yield result
+    finally:
+        data.close()
@@ -0,0 +1,239 @@
+# coding=utf-8
+
+"""Read decrypted PKM dumps as NumPy record arrays.
+
+Once decrypted, every PKM record is laid out at fixed offsets, so a
+buffer of N records can be viewed (without copying) as an array with
+one column per field:
+
+    >>> from pypkm import columnar
+    >>> pkms = columnar.frombuffer(decrypted_dump, gen=4)
+    >>> pkms['id'], pkms['exp'], pkms['evs']['speed']
+    >>> columnar.bitfield(pkms, 'ivs.hp')
+
+The dtypes are derived from the Construct structs in pypkm.structs, so
+they always match pkm_struct and pkm_party_struct. Fields packed into
+bits (IVs, flags, ribbons) can't be NumPy fields of their own; the
+BitStruct they're in is a single integer column (named after it, like
+'x38' for the IVs) and bitfield() extracts them by name.
+
+Every other column holds the raw stored value: byte-sized flags are
+0/1 bytes (Construct reads anything but 1 as False) and names are the
+encoded characters.
+
+NumPy is required for this module.
+"""
+
+__author__ = 'Patrick Jacobs <ceolwulf@gmail.com>'
+
+import numpy
+from construct import (Adapter, Buffered, FormatField, MappingAdapter,
+    MetaArray, PaddingAdapter, Reconfig, StaticField, Struct)
+from construct.lib import decode_bin
+from pypkm.lazy import lazy_import
+
+_structs = {
+    4: lazy_import('pypkm.structs.gen4'),
+    5: lazy_import('pypkm.structs.gen5'),
+}
+
+# struct format characters -> numpy type characters
+_formats = {
+    'B': 'u1', 'b': 'i1', 'H': 'u2', 'h': 'i2', 'I': 'u4', 'i': 'i4',
+    'L': 'u4', 'l': 'i4', 'Q': 'u8', 'q': 'i8',
+}
+
+class _Layout(object):
+    """Builds the dtype of a struct and finds its bit fields.
+
+    Keyword arguments:
+    strc (construct.Struct) -- the struct to lay out
+    """
+
+    def __init__(self, strc):
+        # dotted name -> (column path, shift, mask, is a flag)
+        self.bitfields = {}
+        self.dtype = self.struct(strc, (), '')
+
+    def struct(self, strc, path, prefix):
+        "Return the dtype of a (byte-level) struct."
+
+        spec = {'names': [], 'formats': [], 'offsets': [], 'itemsize': strc.sizeof()}
+        self.fields(strc, path, prefix, 0, spec)
+
+        return numpy.dtype(spec)
+
+    def add(self, spec, name, fmt, offset):
+        "Add a field, replacing an earlier one of the same name."
+
+        if name in spec['names']:
+            i = spec['names'].index(name)
+            for key in ('names', 'formats', 'offsets'):
+                del spec[key][i]
+
+        spec['names'].append(name)
+        spec['formats'].append(fmt)
+        spec['offsets'].append(offset)
+
+    def fields(self, strc, path, prefix, offset, spec):
+        "Add the fields of a struct (and its embedded structs) to spec."
+
+        for subcon in strc.subcons:
+            size = subcon.sizeof()
+
+            if subcon.conflags & subcon.FLAG_EMBED:
+                inner = subcon
+                while isinstance(inner, Reconfig):
+                    inner = inner.subcon
+                if isinstance(inner, Struct):
+                    self.fields(inner, path, prefix, offset, spec)
+                else:
+                    # an embedded BitStruct's fields are top-level names
+                    self.add(spec, inner.name, self.buffered(inner, path, prefix), offset)
+            elif subcon.name is not None and not isinstance(subcon, PaddingAdapter):
+                self.add(spec, subcon.name, self.value(subcon, path, prefix), offset)
+
+            offset += size
+
+    def value(self, subcon, path, prefix):
+        "Return the dtype of a byte-level field."
+
+        if isinstance(subcon, FormatField):
+            (order, code) = (subcon.packer.format[0], subcon.packer.format[1:])
+            return '{}{}'.format('|' if code in 'Bb' else order, _formats[code])
+
+        if isinstance(subcon, StaticField):
+            return ('u1', (subcon.length,)) if subcon.length > 1 else 'u1'
+
+        if isinstance(subcon, MetaArray):
+            return (self.value(subcon.subcon, path, prefix), (subcon.countfunc(None),))
+
+        if isinstance(subcon, Buffered):
+            return self.buffered(subcon, path + (subcon.name,),
+                                 '{}{}.'.format(prefix, subcon.name))
+
+        if isinstance(subcon, Struct):
+            return self.struct(subcon, path + (subcon.name,),
+                               '{}{}.'.format(prefix, subcon.name))
+
+        if isinstance(subcon, Adapter):
+            return self.value(subcon.subcon, path, prefix)
+
+        raise TypeError('cannot lay out {!r}'.format(subcon))
+
+    def buffered(self, subcon, path, prefix):
+        """Return the integer dtype of a BitStruct (optionally Swapped)
+        and register its bit fields."""
+
+        order = '>'
+        if subcon.encoder is not decode_bin:
+            # util.Swapped, which reverses the bytes
+            order = '<'
+            subcon = subcon.subcon
+
+        strc = subcon.subcon
+        width = strc.sizeof()
+        if not path or path[-1] != strc.name:
+            path = path + (strc.name,)
+
+        self.bits(strc, path, prefix, width, 0)
+
+        return '{}u{}'.format(order if width > 8 else '|', width // 8)
+
+    def bits(self, strc, path, prefix, width, position):
+        "Register the fields of a bit-level struct, from the top bit down."
+
+        for subcon in strc.subcons:
+            if isinstance(subcon, PaddingAdapter):
+                position += subcon.subcon.length
+                continue
+
+            if isinstance(subcon, Struct):
+                position = self.bits(subcon, path, '{}{}.'.format(prefix, subcon.name),
+                                     width, position)
+                continue
+
+            length = subcon.subcon.length
+            shift = width - position - length
+            flag = isinstance(subcon, MappingAdapter) and length == 1
+            self.bitfields[prefix + subcon.name] = (path, shift, (1 << length) - 1, flag)
+            position += length
+
+        return position
+
+# Layouts, keyed by (gen, party)
+_layouts = {}
+
+# Bit fields, keyed by dtype
+_bitfields = {}
+
+def _layout(gen, party=False):
+    key = (gen, party)
+    layout = _layouts.get(key)
+
+    if layout is None:
+        if gen not in _structs:
+            raise ValueError('unsupported generation: {}'.format(gen))
+        structs = _structs[gen]
+        layout = _Layout(structs.pkm_party_struct if party else structs.pkm_struct)
+        _layouts[key] = layout
+        _bitfields[layout.dtype] = layout.bitfields
+
+    return layout
+
+def record_dtype(gen, party=False):
+    """Return the dtype of a decrypted PKM record.
+
+    Keyword arguments:
+    gen (int) -- the game generation
+    party (bool) -- include the battle data (pkm_party_struct)
+    """
+
+    return _layout(gen, party).dtype
+
+def frombuffer(data, gen, record_size=136):
+    """View a buffer of decrypted, concatenated PKM records as an array.
+
+    The array shares the buffer's memory, so it's read-only if the
+    buffer is (like a str).
+
+    Keyword arguments:
+    data (str or buffer) -- the concatenated records
+    gen (int) -- the game generation
+    record_size (int) -- 136 for box records, or the party size
+    """
+
+    dtype = record_dtype(gen, party=(record_size != 136))
+    if record_size != dtype.itemsize:
+        raise ValueError('invalid record size: {}'.format(record_size))
+    if len(data) % record_size != 0:
+        raise ValueError('data is not a multiple of {} bytes'.format(record_size))
+
+    return numpy.frombuffer(data, dtype=dtype)
+
+def bitfield(records, name):
+    """Extract a bit field (like 'ivs.hp', 'is_egg' or
+    'markings.circle') from a record array.
+
+    Flags are returned as booleans and other fields as integers.
+
+    Keyword arguments:
+    records (numpy.ndarray) -- from frombuffer()
+    name (str) -- the field's name, dotted through structs
+    """
+
+    bitfields = _bitfields.get(records.dtype)
+    if bitfields is None:
+        raise ValueError('not a PKM record array')
+    if name not in bitfields:
+        raise KeyError(name)
+
+    (path, shift, mask, flag) = bitfields[name]
+
+    column = records
+    for part in path:
+        column = column[part]
+
+    values = (column >> shift) & mask
+
+    return values.astype(bool) if flag else values
@@ -0,0 +1,346 @@
+# coding=utf-8
+
+"""Compile fixed-size Construct structs into struct-module codecs.
+
+Every PKM and GTS layout is a fixed size, so there's no need to
+interpret the Construct definitions field by field on every parse.
+This module walks a Struct once and generates a pair of Python
+functions for it: one that unpacks the whole buffer with a single
+struct.Struct.unpack_from() call and one that packs a Container back
+with struct.Struct.pack(). BitStructs are read as one integer and
+split with shifts and masks.
+
+The compiled codec parses to (and builds from) the same Container
+objects as Construct does, so it can be swapped in wherever a Struct's
+parse(), build() and sizeof() are used:
+
+    >>> from pypkm.compiler import compile_struct
+    >>> from pypkm.structs import gen4
+    >>> codec = compile_struct(gen4.pkm_struct)
+    >>> codec.parse(data) == gen4.pkm_struct.parse(data)
+    True
+
+Only the constructs used by PyPKM's structs are supported; anything
+else raises a CompileError.
+"""
+
+__author__ = 'Patrick Jacobs <ceolwulf@gmail.com>'
+
+import struct
+from collections import OrderedDict
+from construct import (Adapter, Buffered, Container, FormatField,
+    MappingAdapter, MetaArray, PaddingAdapter, Reconfig, StaticField,
+    Struct)
+from construct.adapters import BitIntegerAdapter
+from construct.lib import bin_to_int, decode_bin, ListContainer
+
+class CompileError(Exception):
+    pass
+
+class CompiledStruct(object):
+    """A compiled codec with the same interface as a Construct Struct.
+
+    Keyword arguments:
+    name (str) -- the name of the original struct
+    parse (function) -- converts byte data to a Container
+    build (function) -- converts a Container to byte data
+    size (int) -- the length of the byte data
+    source (str) -- the generated source code, for debugging
+    """
+
+    def __init__(self, name, parse, build, size, source):
+        self.name = name
+        self.parse = parse
+        self.build = build
+        self.size = size
+        self.source = source
+
+    def sizeof(self):
+        return self.size
+
+class _Compiler(object):
+    """Generates the source of a struct's parse and build functions.
+
+    The format string grows as fields are visited. Each field adds an
+    expression for parsing (in terms of the unpacked tuple `v`) and a
+    piece of the argument list for building (in terms of `obj`).
+    """
+
+    def __init__(self):
+        self.codes = []
+        self.count = 0
+        self.pieces = []
+        self.helpers = {}
+
+    def helper(self, obj):
+        "Make an object available to the generated code by name."
+
+        name = '_h{}'.format(len(self.helpers))
+        self.helpers[name] = obj
+
+        return name
+
+    def unpacked(self, code, values=1):
+        "Add a format code and return the index of its first value."
+
+        self.codes.append(code)
+        index = self.count
+        self.count += values
+
+        return index
+
+    def fields(self, strc, path):
+        """Compile a byte-level struct and return its (name, expression)
+        pairs, including the fields of any embedded structs."""
+
+        fields = OrderedDict()
+
+        for subcon in strc.subcons:
+            if subcon.conflags & subcon.FLAG_EMBED:
+                inner = subcon
+                while isinstance(inner, Reconfig):
+                    inner = inner.subcon
+                if isinstance(inner, Struct):
+                    fields.update(self.fields(inner, path))
+                elif isinstance(inner, Buffered):
+                    fields.update(self.buffered(inner, path))
+                else:
+                    raise CompileError('cannot embed {!r}'.format(inner))
+            elif subcon.name is None:
+                self.value(subcon, None)
+            else:
+                # a repeated name keeps its last value, like Construct
+                fields.pop(subcon.name, None)
+                fields[subcon.name] = self.value(subcon, '{}.{}'.format(path, subcon.name))
+
+        return fields.items()
+
+    def container(self, fields):
+        "Return an expression that creates a Container of the fields."
+
+        return '_Container({})'.format(', '.join(
+            '{}={}'.format(name, expr) for (name, expr) in fields))
+
+    def value(self, subcon, path):
+        """Compile a byte-level field and return its parse expression.
+
+        `path` is the expression for the field's value when building.
+        """
+
+        if isinstance(subcon, PaddingAdapter):
+            length = subcon.subcon.length
+            if subcon.pattern == '\x00':
+                self.codes.append('{}x'.format(length))
+            else:
+                self.unpacked('{}s'.format(length))
+                self.pieces.append(('one', repr(subcon.pattern * length)))
+            return None
+
+        if isinstance(subcon, FormatField):
+            (order, code) = (subcon.packer.format[0], subcon.packer.format[1:])
+            index = self.unpacked(code if order == '<' or subcon.packer.size == 1
+                                  else '{}s'.format(subcon.packer.size))
+            if code == self.codes[-1]:
+                self.pieces.append(('one', path))
+                return 'v[{}]'.format(index)
+            # big endian fields are unpacked on their own
+            packer = self.helper(subcon.packer)
+            self.pieces.append(('one', '{}.pack({})'.format(packer, path)))
+            return '{}.unpack(v[{}])[0]'.format(packer, index)
+
+        if isinstance(subcon, StaticField):
+            index = self.unpacked('{}s'.format(subcon.length))
+            self.pieces.append(('one', path))
+            return 'v[{}]'.format(index)
+
+        if isinstance(subcon, MetaArray):
+            count = subcon.countfunc(Container())
+            if not isinstance(subcon.subcon, FormatField) or subcon.subcon.packer.format[0] != '<':
+                raise CompileError('cannot compile array of {!r}'.format(subcon.subcon))
+            index = self.unpacked('{}{}'.format(count, subcon.subcon.packer.format[1:]), count)
+            self.pieces.append(('many', path))
+            return '_ListContainer(v[{}:{}])'.format(index, index + count)
+
+        if isinstance(subcon, MappingAdapter):
+            if not isinstance(subcon.subcon, StaticField) or subcon.subcon.length != 1:
+                raise CompileError('cannot compile mapping of {!r}'.format(subcon.subcon))
+            index = self.unpacked('B')
+            table = self.helper(tuple(subcon._decode(chr(i), None) for i in range(256)))
+            encoder = self.helper(subcon._encode)
+            self.pieces.append(('one', 'ord({}({}, None))'.format(encoder, path)))
+            return '{}[v[{}]]'.format(table, index)
+
+        if isinstance(subcon, Adapter):
+            adapter = self.helper(subcon)
+            inner = self.value(subcon.subcon, '{}._encode({}, None)'.format(adapter, path))
+            return '{}._decode({}, None)'.format(adapter, inner)
+
+        if isinstance(subcon, Struct):
+            return self.container(self.fields(subcon, path))
+
+        if isinstance(subcon, Buffered):
+            return self.container(self.buffered(subcon, path))
+
+        raise CompileError('cannot compile {!r}'.format(subcon))
+
+    def buffered(self, subcon, path):
+        """Compile a BitStruct (optionally Swapped) and return its
+        (name, expression) pairs."""
+
+        swapped = False
+        if subcon.encoder is not decode_bin:
+            # util.Swapped, which reverses the bytes
+            if subcon.decoder('\x00\x01') != '\x01\x00':
+                raise CompileError('cannot compile buffer {!r}'.format(subcon))
+            swapped = True
+            subcon = subcon.subcon
+
+        if not isinstance(subcon, Buffered) or subcon.encoder is not decode_bin:
+            raise CompileError('cannot compile buffer {!r}'.format(subcon))
+
+        strc = subcon.subcon
+        width = strc.sizeof()
+        size = width // 8
+
+        # the whole bitstruct is read as a single integer
+        codes = {1: 'B', 2: 'H', 4: 'L', 8: 'Q'}
+        if size in codes and (swapped or size == 1):
+            index = self.unpacked(codes[size])
+            number = 'v[{}]'.format(index)
+        else:
+            index = self.unpacked('{}s'.format(size))
+            number = '_bytes_to_int(v[{}], {})'.format(index, swapped)
+
+        terms = []
+        (fields, position) = self.bitfields(strc, path, number, terms, width, 0)
+
+        built = ' | '.join(terms) or '0'
+        if number.startswith('v['):
+            self.pieces.append(('one', built))
+        else:
+            self.pieces.append(('one', '_int_to_bytes({}, {}, {})'.format(built, size, swapped)))
+
+        return fields
+
+    def bitfields(self, strc, path, number, terms, width, position):
+        """Compile the fields of a bit-level struct.
+
+        Fields are laid out from the most significant bit down. Returns
+        the (name, expression) pairs and the next bit position.
+        """
+
+        fields = []
+
+        for subcon in strc.subcons:
+            if isinstance(subcon, PaddingAdapter):
+                position += subcon.subcon.length
+                continue
+
+            if isinstance(subcon, Struct):
+                (inner, position) = self.bitfields(subcon, '{}.{}'.format(path, subcon.name),
+                                                   number, terms, width, position)
+                fields.append((subcon.name, self.container(inner)))
+                continue
+
+            length = subcon.subcon.length
+            shift = width - position - length
+            mask = (1 << length) - 1
+            position += length
+            value = '{}.{}'.format(path, subcon.name)
+
+            if isinstance(subcon, BitIntegerAdapter) and not (subcon.signed or subcon.swapped):
+                fields.append((subcon.name, '(({} >> {}) & {})'.format(number, shift, mask)))
+                terms.append('(({} & {}) << {})'.format(value, mask, shift))
+            elif isinstance(subcon, MappingAdapter):
+                table = self.helper(tuple(
+                    subcon._decode(''.join('\x00\x01'[(i >> bit) & 1]
+                                           for bit in reversed(range(length))), None)
+                    for i in range(1 << length)
+                ))
+                encoder = self.helper(subcon._encode)
+                fields.append((subcon.name, '{}[({} >> {}) & {}]'.format(table, number, shift, mask)))
+                terms.append('(_bin_to_int({}({}, None)) << {})'.format(encoder, value, shift))
+            else:
+                raise CompileError('cannot compile bit field {!r}'.format(subcon))
+
+        return (fields, position)
+
+    def source(self, strc):
+        "Generate the source of the parse and build functions."
+
+        parse_expr = self.container(self.fields(strc, 'obj'))
+
+        args = []
+        for (kind, expr) in self.pieces:
+            if kind == 'one':
+                if args and args[-1][0] == 'one':
+                    args[-1][1].append(expr)
+                else:
+                    args.append(('one', [expr]))
+            else:
+                args.append(('many', expr))
+
+        build_args = ' + '.join(
+            '[{}]'.format(', '.join(expr)) if kind == 'one' else 'list({})'.format(expr)
+            for (kind, expr) in args
+        ) or '[]'
+
+        return '\n'.join([
+            'def parse(data):',
+            '    v = _unpack_from(data)',
+            '    return {}'.format(parse_expr),
+            '',
+            'def build(obj):',
+            '    return _pack(*({}))'.format(build_args),
+            '',
+        ])
+
+def _bytes_to_int(data, swapped):
+    "Convert bytes to an integer (big endian unless swapped)."
+
+    if swapped:
+        data = data[::-1]
+
+    return int(data.encode('hex') or '0', 16)
+
+def _int_to_bytes(number, size, swapped):
+    "Convert an integer to bytes (big endian unless swapped)."
+
+    data = ('%0*x' % (size * 2, number)).decode('hex')[-size:]
+
+    return data[::-1] if swapped else data
+
+# Compiled codecs, keyed by the id of the original struct
+_compiled = {}
+
+def compile_struct(strc):
+    """Compile a fixed-size Construct Struct (once) into a codec.
+
+    Keyword arguments:
+    strc (construct.Struct) -- the struct to compile
+    """
+
+    codec = _compiled.get(id(strc))
+
+    if codec is None:
+        compiler = _Compiler()
+        source = compiler.source(strc)
+        packer = struct.Struct('<' + ''.join(compiler.codes))
+
+        namespace = dict(compiler.helpers)
+        namespace.update({
+            '_Container': Container,
+            '_ListContainer': ListContainer,
+            '_bin_to_int': bin_to_int,
+            '_bytes_to_int': _bytes_to_int,
+            '_int_to_bytes': _int_to_bytes,
+            '_pack': packer.pack,
+            '_unpack_from': packer.unpack_from,
+        })
+        exec(compile(source, '<compiled {}>'.format(strc.name), 'exec'), namespace)
+
+        codec = CompiledStruct(strc.name, namespace['parse'], namespace['build'],
+                               packer.size, source)
+        _compiled[id(strc)] = codec
+
+    return codec
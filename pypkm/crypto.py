@@ -25,9 +25,18 @@ checksum.
 
 __author__ = "Patrick Jacobs <ceolwulf@gmail.com>"
 
+import mmap
+import os
 import struct
 from array import array
+from binascii import hexlify, unhexlify
+from collections import OrderedDict
 from pypkm.rng import Prng, Arng, Grng
+from pypkm.lazy import lazy_import
+
+# NumPy (if it's installed) is only imported when a batch function
+# first uses it
+numpy = lazy_import('numpy', optional=True)
 
 def checksum(data, size='H'):
     """Calculate the checksum of data using size as word-length.
@@ -46,42 +55,8 @@ def checksum(data, size='H'):
     
     return chksum
 
-def _unshuffle(pv, data):
-    """Unshuffle PKM binary data according to a shift value.
-
-    Unshuffling data has different permuations than shuffling data.
-    Until I figure out a way to convey this pattern mathematically,
-    I'll have to resort to hardcoding the stray permutations in a
-    dict.
-
-    Keyword arguments:
-    pv (int) -- the Pokémon's personality value
-    data (int) -- the PKM data to unshuffle
-    """
-    stray_perms = {
-        8: 12,
-        9: 18,
-        10: 13,
-        11: 19,
-        12: 8,
-        13: 10,
-        15: 20,
-        17: 22,
-        18: 9,
-        19: 11,
-        20: 15,
-        22: 17,
-    }
-
-    shiftval = ((pv >> 0xD) & 0x1F) % 24
-
-    if stray_perms.get(shiftval) is None:
-        return _shuffle(pv, data)
-    
-    return _shuffle(pv, data, shiftval=stray_perms.get(shiftval))
-
-def _shuffle(pv, data, shiftval=None):
-    """Shuffle the data according to a shift value derived from the PV.
+def _block_orders():
+    """Calculate the order of the four blocks for every shift value.
     
     Data stored in .pkm files is split into five blocks: one
     unencrypted block the PV and checksum, and four encrypted blocks
@@ -89,10 +64,6 @@ def _shuffle(pv, data, shiftval=None):
     or decrypt (for reading) .pkm files, the four encrypted blocks must
     be shuffled based on the supplied PV.
     
-    The data must be a multiple of 4 or it will be padded to fit. Most
-    of the time, the supplied data will be 128 bytes (the length of
-    Pokémon data).
-    
     The blocks are shifted in an ascending permutation.  To wit:
         00 = ABCD   01 = ABDC   02 = ACBD   03 = ACDB
         04 = ADBC   05 = ADCB   06 = BACD   07 = BADC
@@ -120,49 +91,168 @@ def _shuffle(pv, data, shiftval=None):
     
         pop #4 is always the remaining element.
      
-    The previous comment section (along with basically this entire
-    function) was stolen directly from tsanth's code because it's
-    great.
+    The previous comment section was stolen directly from tsanth's
+    code because it's great.
+    """
+
+    orders = []
+
+    for shiftval in range(0, 24):
+        blocks = [0, 1, 2, 3]
+        blockorder = [
+            shiftval // 6,
+            (shiftval % 6) // 2,
+            (shiftval % 6) % 2,
+            0,
+        ]
+        orders.append(tuple(blocks.pop(block) for block in blockorder))
+
+    return tuple(orders)
+
+def _inverse_orders(orders):
+    """Calculate the block orders that undo each of the given orders.
+
+    If block `i` of the shuffled data came from block `order[i]`, then
+    unshuffling has to put it back: inverse[order[i]] = i.
 
     Keyword arguments:
-    pv (int) -- personality value
-    data (string) -- 128 byte length of Pokémon data
-    shiftval (int) -- optional forced shift value
+    orders (tuple) -- the block orders to invert
     """
-        
-    # Pad the data to fit into a multiple of 4.
+
+    inverses = []
+
+    for order in orders:
+        inverse = [0] * 4
+        for (i, block) in enumerate(order):
+            inverse[block] = i
+        inverses.append(tuple(inverse))
+
+    return tuple(inverses)
+
+# The block order of every shift value, calculated once at import.
+# SHUFFLE_ORDERS[shiftval][i] is the block that ends up in position i.
+SHUFFLE_ORDERS = _block_orders()
+UNSHUFFLE_ORDERS = _inverse_orders(SHUFFLE_ORDERS)
+
+def _shiftval(pv):
+    """Calculate the shift value of a PV.
+
+    Keyword arguments:
+    pv (int) -- the Pokémon's personality value
+    """
+
+    return ((pv >> 0xD) & 0x1F) % 24
+
+def _reorder(data, order, out=None, offset=0):
+    """Copy the four blocks of data into out in the given order.
+
+    The blocks are sliced from a memoryview, so nothing is copied
+    except into the destination buffer.
+
+    Keyword arguments:
+    data (string) -- the data to reorder (a multiple of 4 in length)
+    order (tuple) -- the block order to use
+    out (bytearray) -- optional buffer to write into
+    offset (int) -- where to start writing in out
+    """
+
+    if out is None:
+        out = bytearray(len(data))
+
+    view = memoryview(data)
+    blocksize = len(data) // 4
+
+    for (i, block) in enumerate(order):
+        start = offset + (i * blocksize)
+        out[start:(start + blocksize)] = view[(block * blocksize):((block + 1) * blocksize)]
+
+    return out
+
+def _pad(data):
+    "Pad the data to fit into a multiple of 4."
+
     if len(data) % 4 != 0:
         data += '\x00' * (4 - (len(data) % 4))
+
+    return data
+
+def _unshuffle(pv, data):
+    """Unshuffle PKM binary data according to a shift value.
+
+    Keyword arguments:
+    pv (int) -- the Pokémon's personality value
+    data (int) -- the PKM data to unshuffle
+    """
+
+    data = _pad(data)
+
+    return str(_reorder(data, UNSHUFFLE_ORDERS[_shiftval(pv)]))
+
+def _shuffle(pv, data, shiftval=None):
+    """Shuffle the data according to a shift value derived from the PV.
     
-    # Create the blocks of data using its length.
-    blocksize = len(data) / 4
-    blocks = [
-        data[:(blocksize * 1)],
-        data[(blocksize * 1):(blocksize * 2)],
-        data[(blocksize * 2):(blocksize * 3)],
-        data[(blocksize * 3):],
-    ]
-    
+    The data must be a multiple of 4 or it will be padded to fit. Most
+    of the time, the supplied data will be 128 bytes (the length of
+    Pokémon data). See _block_orders() for how the blocks are ordered.
+
+    Keyword arguments:
+    pv (int) -- personality value
+    data (string) -- 128 byte length of Pokémon data
+    shiftval (int) -- optional forced shift value
+    """
+
+    data = _pad(data)
+
     # The shift value is derived from the PV
     if shiftval is None:
-        shiftval = ((pv >> 0xD) & 0x1F) % 24
-    
-    blockorder = [
-        shiftval / 6,
-        (shiftval % 6) / 2,
-        (shiftval % 6) % 2,
-        0,
-    ]
-    
-    shuffledblocks = []
-    
-    # Grab the correct block according to the block order.
-    for block in blockorder:
-        shuffledblocks.append(blocks.pop(block))
-    
-    shuffledblocks = ''.join(shuffledblocks)
-    
-    return shuffledblocks
+        shiftval = _shiftval(pv)
+
+    return str(_reorder(data, SHUFFLE_ORDERS[shiftval]))
+
+def _shuffle_records(data, record_size, orders):
+    """Reorder the box data of every PKM file in a buffer.
+
+    Keyword arguments:
+    data (string) -- the concatenated PKM files
+    record_size (int) -- the length of each PKM file
+    orders (tuple) -- SHUFFLE_ORDERS or UNSHUFFLE_ORDERS
+    """
+
+    if record_size < 136:
+        raise ValueError('invalid record size: {}'.format(record_size))
+    if len(data) % record_size != 0:
+        raise ValueError('data is not a multiple of {} bytes'.format(record_size))
+
+    # the header and party data are copied as-is
+    out = bytearray(data)
+    view = memoryview(data)
+
+    for offset in range(0, len(data), record_size):
+        pv = struct.unpack_from('<L', data, offset)[0]
+        box_data = view[(offset + 8):(offset + 136)]
+        _reorder(box_data, orders[_shiftval(pv)], out, offset + 8)
+
+    return str(out)
+
+def shuffle_many(data, record_size):
+    """Shuffle the box data of every PKM file in a buffer.
+
+    Keyword arguments:
+    data (string) -- the concatenated PKM files
+    record_size (int) -- the length of each file (136, 220 or 236)
+    """
+
+    return _shuffle_records(data, record_size, SHUFFLE_ORDERS)
+
+def unshuffle_many(data, record_size):
+    """Unshuffle the box data of every PKM file in a buffer.
+
+    Keyword arguments:
+    data (string) -- the concatenated PKM files
+    record_size (int) -- the length of each file (136, 220 or 236)
+    """
+
+    return _shuffle_records(data, record_size, UNSHUFFLE_ORDERS)
 
 def _unpack(data):
     """Unpack a PKM file into Pokémon data.
@@ -211,6 +301,218 @@ def _crypt(seed, data, obj=Prng):
     
     return new_data.tostring()
 
+def _xor(data, stream):
+    """XOR data with a keystream of at least the same length.
+
+    Both strings are converted to big integers so the XOR happens in
+    one operation instead of one per word.
+
+    Keyword arguments:
+    data (string) -- the data to process
+    stream (string) -- the keystream
+    """
+
+    if not data:
+        return data
+
+    value = int(hexlify(data), 16) ^ int(hexlify(stream[:len(data)]), 16)
+
+    return unhexlify('%0*x' % (len(data) * 2, value))
+
+def _keystream(seed, length, obj=Prng):
+    """Calculate the keystream of a seed as a string.
+
+    Keyword arguments:
+    seed (int) -- the seed to use in the LC RNG
+    length (int) -- the number of words to generate
+    obj (class) -- the LC RNG class to use
+    """
+
+    lc = obj(seed)
+
+    return array('H', [lc._advance() for i in range(length)]).tostring()
+
+class KeystreamTable(object):
+    """The box data keystream of every possible checksum.
+
+    The box data is encrypted with an LC RNG seeded by the 16-bit
+    checksum, so there are only 65,536 keystreams of 64 words each
+    (8 MB in total). The table is built the first time it's used. If
+    a path is given, the table is saved there and memory-mapped so
+    other processes can share it.
+
+    Keyword arguments:
+    obj (class) -- the LC RNG class to use
+    path (str) -- optional file to store the table in
+    """
+
+    seeds = 0x10000
+    length = 64
+
+    def __init__(self, obj=Prng, path=None):
+        self.obj = obj
+        self.path = path
+        self._data = None
+
+    def _build(self):
+        "Calculate the keystream of every seed."
+
+        if numpy is not None:
+            streams = _keystreams(range(self.seeds), self.length, self.obj)
+            return streams.tostring()
+
+        return ''.join(_keystream(seed, self.length, self.obj)
+                       for seed in range(self.seeds))
+
+    def _load(self):
+        "Load the table from its file, building it if necessary."
+
+        if self.path is None:
+            return self._build()
+
+        size = self.seeds * self.length * 2
+        if not os.path.exists(self.path) or os.path.getsize(self.path) != size:
+            # write somewhere else first so nobody maps half a table
+            tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                f.write(self._build())
+            os.rename(tmp_path, self.path)
+
+        with open(self.path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def data(self):
+        "The whole table as a string (or memory map)."
+
+        if self._data is None:
+            self._data = self._load()
+
+        return self._data
+
+    def row(self, seed):
+        """Return the keystream of a seed.
+
+        Keyword arguments:
+        seed (int) -- the 16-bit seed
+        """
+
+        offset = seed * self.length * 2
+
+        return self.data[offset:(offset + (self.length * 2))]
+
+    def rows(self, seeds):
+        """Return the keystreams of many seeds as an N x 64 matrix.
+
+        Keyword arguments:
+        seeds (array) -- the 16-bit seeds
+        """
+
+        table = numpy.frombuffer(self.data, dtype=numpy.uint16)
+
+        return table.reshape(self.seeds, self.length)[seeds]
+
+class KeystreamCache(object):
+    """A least-recently-used cache of keystreams keyed by seed.
+
+    The party data is encrypted with an LC RNG seeded by the full
+    32-bit PV, which is too many keystreams to precompute, but the
+    same Pokémon tends to be decrypted over and over on the GTS.
+
+    Keyword arguments:
+    obj (class) -- the LC RNG class to use
+    size (int) -- the number of keystreams to remember
+    """
+
+    def __init__(self, obj=Prng, size=1024):
+        self.obj = obj
+        self.size = size
+        self._streams = OrderedDict()
+
+    def get(self, seed, length):
+        """Return the keystream of a seed.
+
+        Keyword arguments:
+        seed (int) -- the seed to use in the LC RNG
+        length (int) -- the number of words needed
+        """
+
+        key = (seed, length)
+        stream = self._streams.pop(key, None)
+
+        if stream is None:
+            stream = _keystream(seed, length, self.obj)
+            if len(self._streams) >= self.size:
+                self._streams.popitem(last=False)
+
+        self._streams[key] = stream
+
+        return stream
+
+# Keystream caches used by encrypt() and decrypt(), keyed by LC RNG
+# class. See enable_keystream_cache().
+_box_tables = None
+_party_caches = None
+
+def enable_keystream_cache(directory=None, party_size=1024):
+    """Cache keystreams to speed up encryption and decryption.
+
+    Box data is decrypted with a row of a precomputed KeystreamTable,
+    and party data keystreams are kept in a KeystreamCache.
+
+    Keyword arguments:
+    directory (str) -- optional directory to store the box keystream
+        tables in so they can be memory-mapped
+    party_size (int) -- the number of party keystreams to remember
+    """
+
+    global _box_tables, _party_caches
+
+    _box_tables = {}
+    _party_caches = {}
+
+    for obj in (Prng, Grng):
+        path = None
+        if directory is not None:
+            path = os.path.join(directory, '{}.keystream'.format(obj.__name__.lower()))
+
+        _box_tables[obj] = KeystreamTable(obj, path)
+        _party_caches[obj] = KeystreamCache(obj, party_size)
+
+def disable_keystream_cache():
+    "Stop caching keystreams and free the caches."
+
+    global _box_tables, _party_caches
+
+    _box_tables = None
+    _party_caches = None
+
+def _crypt_box(seed, data, obj=Prng):
+    """Encrypts/decrypts box data, using the keystream table if enabled.
+
+    Keyword arguments:
+    seed (int) -- the checksum
+    data (string) -- the box data to process
+    """
+
+    if _box_tables is None or len(data) != 128:
+        return _crypt(seed, data, obj)
+
+    return _xor(data, _box_tables[obj].row(seed))
+
+def _crypt_party(seed, data, obj=Prng):
+    """Encrypts/decrypts party data, using the keystream cache if enabled.
+
+    Keyword arguments:
+    seed (int) -- the PV
+    data (string) -- the party data to process
+    """
+
+    if _party_caches is None:
+        return _crypt(seed, data, obj)
+
+    return _xor(data, _party_caches[obj].get(seed, len(data) // 2))
+
 def encrypt(data):
     """Encrypt PKM data.
 
@@ -221,10 +523,10 @@ def encrypt(data):
     (pv, chksum, box_data, party_data) = _unpack(data)
 
     box_data = _shuffle(pv, box_data)
-    chksum = _checksum(box_data)
-    box_data = _crypt(chksum, box_data)
+    chksum = checksum(box_data)
+    box_data = _crypt_box(chksum, box_data)
 
-    party_data = _crypt(pv, party_data)
+    party_data = _crypt_party(pv, party_data)
 
     return _pack(pv, chksum, box_data, party_data)
 
@@ -237,10 +539,10 @@ def decrypt(data):
 
     (pv, chksum, box_data, party_data) = _unpack(data)
     
-    box_data = _crypt(chksum, box_data)
+    box_data = _crypt_box(chksum, box_data)
     box_data = _unshuffle(pv, box_data)
 
-    party_data = _crypt(pv, party_data)
+    party_data = _crypt_party(pv, party_data)
 
     return _pack(pv, chksum, box_data, party_data)
 
@@ -253,10 +555,10 @@ def encrypt_gts(data):
     (pv, chksum, box_data, party_data) = _unpack(data)
 
     box_data = _shuffle(pv, box_data)
-    chksum = _checksum(box_data)
-    box_data = _crypt(chksum, box_data, obj=Grng)
+    chksum = checksum(box_data)
+    box_data = _crypt_box(chksum, box_data, obj=Grng)
 
-    party_data = _crypt(pv, party_data, obj=Grng)
+    party_data = _crypt_party(pv, party_data, obj=Grng)
 
     return _pack(pv, chksum, box_data, party_data)
 
@@ -268,9 +570,224 @@ def decrypt_gts(data):
     """
     (pv, chksum, box_data, party_data) = _unpack(data)
     
-    box_data = _crypt(chksum, box_data, obj=Grng)
+    box_data = _crypt_box(chksum, box_data, obj=Grng)
     box_data = _unshuffle(pv, box_data)
 
-    party_data = _crypt(pv, party_data, obj=Grng)
+    party_data = _crypt_party(pv, party_data, obj=Grng)
+
+    return _pack(pv, chksum, box_data, party_data)
+
+def _keystreams(seeds, length, obj=Prng):
+    """Calculate the LC RNG output for many seeds at once.
+
+    Every seed's RNG is stepped in lockstep, so the loop runs `length`
+    times no matter how many seeds are given. Returns an N x `length`
+    matrix of 16-bit words.
+
+    Keyword arguments:
+    seeds (sequence) -- the seeds to use in the LC RNG
+    length (int) -- the number of words to generate for each seed
+    obj (class) -- the LC RNG class to use
+    """
+
+    lc = obj()
+    states = numpy.array([obj(int(seed)).seed & lc.mask for seed in seeds],
+                         dtype=numpy.uint64)
+    streams = numpy.empty((len(states), length), dtype=numpy.uint16)
+
+    mult = numpy.uint64(lc.mult)
+    add = numpy.uint64(lc.add)
+    mask = numpy.uint64(lc.mask)
+    width = numpy.uint64(lc.width)
+    outmask = numpy.uint64(lc.outmask)
+
+    for i in range(length):
+        states *= mult
+        states += add
+        states &= mask
+        streams[:, i] = (states >> width) & outmask
+
+    return streams
+
+def _box_keystreams(seeds, obj=Prng):
+    """Return the box data keystreams of many checksums.
+
+    Keyword arguments:
+    seeds (array) -- the checksums
+    obj (class) -- the LC RNG class to use
+    """
+
+    if _box_tables is not None:
+        return _box_tables[obj].rows(seeds)
+
+    return _keystreams(seeds, 64, obj)
+
+def _check_records(data, record_size):
+    """Raise ValueError unless a buffer holds whole PKM files of a
+    valid size.
+
+    Keyword arguments:
+    data (string) -- the concatenated PKM files
+    record_size (int) -- the length of each PKM file
+    """
+
+    if record_size < 136 or record_size % 2 != 0:
+        raise ValueError('invalid record size: {}'.format(record_size))
+    if len(data) % record_size != 0:
+        raise ValueError('data is not a multiple of {} bytes'.format(record_size))
+
+def _records(data, record_size):
+    """View a buffer of concatenated PKM files as a record array.
+
+    Keyword arguments:
+    data (string) -- the concatenated PKM files
+    record_size (int) -- the length of each PKM file
+    """
+
+    _check_records(data, record_size)
+
+    dtype = numpy.dtype([
+        ('pv', '<u4'),
+        ('padding', '<u2'),
+        ('checksum', '<u2'),
+        ('box_data', '<u2', (64,)),
+        ('party_data', '<u2', ((record_size - 136) // 2,)),
+    ])
+
+    return numpy.frombuffer(data, dtype=dtype).copy()
+
+def _crypt_many(data, record_size, encrypting, obj=Prng):
+    """Encrypt/decrypt every PKM file in a buffer in a single pass.
+
+    Keyword arguments:
+    data (string) -- the concatenated PKM files
+    record_size (int) -- the length of each PKM file
+    encrypting (bool) -- True to encrypt, False to decrypt
+    obj (class) -- the LC RNG class to use
+    """
+
+    _check_records(data, record_size)
+
+    if numpy is None:
+        if encrypting:
+            func = encrypt_gts if obj is Grng else encrypt
+        else:
+            func = decrypt_gts if obj is Grng else decrypt
+
+        return ''.join(func(data[i:i + record_size])
+                       for i in range(0, len(data), record_size))
+
+    recs = _records(data, record_size)
+    if len(recs) == 0:
+        return ''
+
+    box_data = recs['box_data']
+    if encrypting:
+        box_data[:] = _shuffle_many(recs['pv'], box_data)
+        recs['checksum'] = box_data.sum(axis=1, dtype=numpy.uint32) & 0xFFFF
+        box_data ^= _box_keystreams(recs['checksum'], obj)
+    else:
+        box_data ^= _box_keystreams(recs['checksum'], obj)
+        box_data[:] = _shuffle_many(recs['pv'], box_data, unshuffle=True)
+
+    party_data = recs['party_data']
+    if party_data.shape[1] > 0:
+        party_data ^= _keystreams(recs['pv'], party_data.shape[1], obj)
+
+    # the padding is always written out as zeroes
+    recs['padding'] = 0
+
+    return recs.tostring()
+
+def _shuffle_many(pvs, box_data, unshuffle=False):
+    """Shuffle/unshuffle the box data of many PKM files at once.
+
+    Keyword arguments:
+    pvs (array) -- the Pokémon's personality values
+    box_data (array) -- an N x 64 matrix of box data words
+    unshuffle (bool) -- True to unshuffle rather than shuffle
+    """
+
+    orders = numpy.array(UNSHUFFLE_ORDERS if unshuffle else SHUFFLE_ORDERS)
+    shiftvals = ((pvs >> 0xD) & 0x1F) % 24
+
+    blocks = box_data.reshape(len(box_data), 4, 16)
+    rows = numpy.arange(len(box_data))[:, None]
+
+    return blocks[rows, orders[shiftvals]].reshape(len(box_data), 64)
+
+def encrypt_many(data, record_size):
+    """Encrypt a buffer of concatenated PKM files.
+
+    The result is identical to calling encrypt() on each file and
+    joining the results, but the LC RNG is stepped for every file at
+    once when NumPy is available.
+
+    Keyword arguments:
+    data (string) -- the concatenated Pokémon data to encrypt
+    record_size (int) -- the length of each file (136, 220 or 236)
+    """
+
+    return _crypt_many(data, record_size, encrypting=True)
+
+def decrypt_many(data, record_size):
+    """Decrypt a buffer of concatenated PKM binaries.
+
+    Keyword arguments:
+    data (string) -- the concatenated PKM binaries to decrypt
+    record_size (int) -- the length of each file (136, 220 or 236)
+    """
+
+    return _crypt_many(data, record_size, encrypting=False)
+
+def encrypt_gts_many(data, record_size):
+    """Encrypt a buffer of concatenated PKM files for use in the GTS.
+
+    Keyword arguments:
+    data (string) -- the concatenated Pokémon data to encrypt
+    record_size (int) -- the length of each file (136, 220 or 236)
+    """
+
+    return _crypt_many(data, record_size, encrypting=True, obj=Grng)
+
+def decrypt_gts_many(data, record_size):
+    """Decrypt a buffer of concatenated PKM bins sent over the GTS.
+
+    Keyword arguments:
+    data (string) -- the concatenated Pokémon binaries to decrypt
+    record_size (int) -- the length of each file (136, 220 or 236)
+    """
+
+    return _crypt_many(data, record_size, encrypting=False, obj=Grng)
+
+def verify_checksums(data, record_size):
+    """Check the stored checksum of every decrypted PKM file in a buffer.
+
+    With NumPy, the buffer is viewed (not copied) as an N x words
+    matrix and the box data of every file is summed in one call.
+    Returns a boolean mask of the files whose checksum matches, and
+    the indices of those that don't (as NumPy arrays, or lists without
+    NumPy).
+
+    Keyword arguments:
+    data (string) -- the concatenated, decrypted PKM files
+    record_size (int) -- the length of each file (136, 220 or 236)
+    """
+
+    if record_size < 136 or record_size % 2 != 0:
+        raise ValueError('invalid record size: {}'.format(record_size))
+    if len(data) % record_size != 0:
+        raise ValueError('data is not a multiple of {} bytes'.format(record_size))
+
+    if numpy is None:
+        mask = []
+        for offset in range(0, len(data), record_size):
+            stored = struct.unpack_from('<H', data, offset + 6)[0]
+            mask.append(checksum(data[(offset + 8):(offset + 136)]) == stored)
+        return (mask, [i for (i, valid) in enumerate(mask) if not valid])
+
+    words = numpy.frombuffer(data, dtype='<u2').reshape(-1, record_size // 2)
+    sums = words[:, 4:68].sum(axis=1, dtype=numpy.uint32) & 0xFFFF
+    mask = sums == words[:, 3]
 
-    return _pack(pv, chksum, box_data, party_data)
\ No newline at end of file
+    return (mask, numpy.flatnonzero(~mask))
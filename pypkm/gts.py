@@ -0,0 +1,732 @@
+# coding=utf-8
+
+"""A stand-in GTS server, and a client to load-test it.
+
+The server speaks a small HTTP API, one set of URLs per generation:
+
+    POST   /gen4/deposit?pid=N     deposit client data (Gen4ClientData)
+    GET    /gen4/result?pid=N      the deposit as server data (Gen4ServerData)
+    DELETE /gen4/deposit?pid=N     take the deposit back
+    GET    /gen4/search?species=N[&count=N]
+                                   up to `count` (default 7) deposits of a
+                                   species, as concatenated server data
+
+Uploads are decoded with topkm() and stored as the payload that
+togtsserver() builds from them. Everything is kept in memory.
+
+Connections are handled by a single asyncore event loop (Python 2 has
+no asyncio), so thousands of them can be open at once. Decoding and
+building the data is CPU-bound, so it's handed to a pool of worker
+processes and the loop only ever does I/O and dict lookups. The event
+loop uses poll(), so this module needs a POSIX system.
+
+Usage:
+    python -m pypkm.gts serve [--host HOST] [--port PORT] [--workers N]
+                              [--threads]
+    python -m pypkm.gts loadtest [--host HOST] [--port PORT] [--gen 4|5]
+                                 [--connections N] [--requests N]
+                                 [--deposit-ratio R] [--search-ratio R]
+"""
+
+__author__ = 'Patrick Jacobs <ceolwulf@gmail.com>'
+
+import os
+import re
+import sys
+import socket
+import random
+import asyncore
+import argparse
+import traceback
+import multiprocessing
+from collections import deque, OrderedDict
+from multiprocessing.pool import ThreadPool
+from timeit import default_timer
+from urlparse import urlsplit, parse_qs
+from pypkm.crypto import checksum
+from pypkm.pkm import get_pkmobj
+
+# The length of the data a game uploads, and of what it downloads
+CLIENT_SIZES = {4: 296, 5: 444}
+SERVER_SIZES = {4: 292, 5: 296}
+
+# The most deposits a search returns, like the real GTS
+SEARCH_COUNT = 7
+
+# Requests bigger than this are refused
+MAX_HEADER = 8192
+MAX_BODY = 4096
+
+# How long (in seconds) a worker has to finish an upload before the
+# client gets a 500, and how often the pool is checked for failures
+TASK_TIMEOUT = 30
+CHECK_INTERVAL = 0.5
+
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Request Entity Too Large',
+    431: 'Request Header Fields Too Large',
+    500: 'Internal Server Error',
+}
+
+_route = re.compile(r'^/gen([45])/(deposit|result|search)$')
+
+def decode_upload(gen, data):
+    """Decode a client upload and build the data the server sends back.
+
+    Uploads whose decrypted data doesn't match its checksum are
+    refused. This runs in a worker, so it returns (species, server
+    data, None), or (None, None, error message) if the upload is
+    invalid, rather than raising.
+
+    Keyword arguments:
+    gen (int) -- the game generation
+    data (str) -- the uploaded client data
+    """
+
+    try:
+        client = get_pkmobj(gen, data)
+        pkm = client.topkm()
+        stored = pkm.checksum
+        if checksum(pkm.tostring()[0x08:0x88]) != stored:
+            return (None, None, 'bad checksum')
+        server = pkm.togtsserver()
+        return (pkm.id, server.tostring(), None)
+    except Exception as e:
+        return (None, None, '{}: {}'.format(type(e).__name__, e))
+
+class _Trigger(asyncore.file_dispatcher):
+    """Runs callbacks from other threads on the event loop.
+
+    Writing to a pipe wakes up the loop, which then calls everything
+    that's been queued.
+    """
+
+    def __init__(self, map):
+        (read_fd, self._write_fd) = os.pipe()
+        asyncore.file_dispatcher.__init__(self, read_fd, map=map)
+        # file_dispatcher keeps its own copy of the descriptor
+        os.close(read_fd)
+        self._calls = deque()
+
+    def call(self, func, *args):
+        "Call func(*args) from the event loop (thread-safe)."
+
+        self._calls.append((func, args))
+        self.wake()
+
+    def wake(self):
+        try:
+            os.write(self._write_fd, 'x')
+        except OSError:
+            # the pipe is full, so the loop will wake anyway
+            pass
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        try:
+            self.recv(4096)
+        except (OSError, socket.error):
+            pass
+
+        while self._calls:
+            (func, args) = self._calls.popleft()
+            func(*args)
+
+    def close(self):
+        asyncore.file_dispatcher.close(self)
+        os.close(self._write_fd)
+
+class _Connection(asyncore.dispatcher):
+    """One client's connection to the server.
+
+    Requests are handled one at a time; reading stops while a request
+    is waiting for its response.
+    """
+
+    def __init__(self, sock, server):
+        asyncore.dispatcher.__init__(self, sock, map=server.map)
+        self.server = server
+        self._in = ''
+        self._out = ''
+        self._busy = False
+        self._keep_alive = True
+
+    def readable(self):
+        return not self._busy and self._keep_alive
+
+    def writable(self):
+        return bool(self._out)
+
+    def handle_read(self):
+        data = self.recv(65536)
+        if data:
+            self._in += data
+            self._process()
+
+    def _process(self):
+        "Handle the next complete request in the buffer, if there is one."
+
+        if self._busy or not self._keep_alive:
+            return
+
+        end = self._in.find('\r\n\r\n')
+        if end < 0:
+            if len(self._in) > MAX_HEADER:
+                self._fail(431)
+            return
+
+        lines = self._in[:end].split('\r\n')
+        try:
+            (method, target, version) = lines[0].split(' ', 2)
+            headers = dict((name.strip().lower(), value.strip()) for (name, value)
+                           in (line.split(':', 1) for line in lines[1:]))
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            self._fail(400)
+            return
+
+        if length < 0:
+            self._fail(400)
+            return
+        if length > MAX_BODY:
+            self._fail(413)
+            return
+
+        start = end + 4
+        if len(self._in) < start + length:
+            return
+
+        body = self._in[start:(start + length)]
+        self._in = self._in[(start + length):]
+
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.0':
+            self._keep_alive = (connection == 'keep-alive')
+        else:
+            self._keep_alive = (connection != 'close')
+
+        (path, query) = urlsplit(target)[2:4]
+        self._busy = True
+        try:
+            self.server.handle_request(self, method, path, parse_qs(query), body)
+        except Exception:
+            traceback.print_exc()
+            self.respond(500)
+
+    def _fail(self, status):
+        self._keep_alive = False
+        self._busy = True
+        self.respond(status)
+
+    def respond(self, status, body=''):
+        """Send the response to the current request.
+
+        Keyword arguments:
+        status (int) -- the HTTP status code
+        body (str) -- the response body
+        """
+
+        if not self.connected:
+            # the client hung up while we were working
+            return
+
+        head = [
+            'HTTP/1.1 {} {}'.format(status, REASONS[status]),
+            'Content-Type: application/octet-stream',
+            'Content-Length: {}'.format(len(body)),
+            'Connection: {}'.format('keep-alive' if self._keep_alive else 'close'),
+        ]
+        self._out += '\r\n'.join(head) + '\r\n\r\n' + body
+        self._busy = False
+
+        self._process()
+
+    def handle_write(self):
+        sent = self.send(self._out)
+        self._out = self._out[sent:]
+
+        if not self._out and not self._keep_alive:
+            self.close()
+
+    def handle_close(self):
+        self.close()
+
+class GTSServer(asyncore.dispatcher):
+    """The GTS stand-in.
+
+    Keyword arguments:
+    address (tuple) -- the (host, port) to listen on; port 0 picks one
+    workers (int) -- the number of workers (default: one per CPU)
+    processes (bool) -- decode in worker processes rather than threads
+    backlog (int) -- the most connections waiting to be accepted
+    """
+
+    def __init__(self, address=('127.0.0.1', 8080), workers=None, processes=True,
+                 backlog=1024):
+        self.map = {}
+        asyncore.dispatcher.__init__(self, map=self.map)
+
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(address)
+        self.listen(backlog)
+        self.address = self.socket.getsockname()
+
+        # gen -> pid -> (species, server data)
+        self.deposits = {4: {}, 5: {}}
+        # gen -> species -> pid -> server data, in deposit order
+        self._species = {4: {}, 5: {}}
+
+        pool_cls = multiprocessing.Pool if processes else ThreadPool
+        self._pool = pool_cls(workers)
+        self._trigger = _Trigger(self.map)
+        self._running = False
+        # (pool result, error function, deadline) of every submitted task
+        self._pending = []
+        self._checked = default_timer()
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            _Connection(pair[0], self)
+
+    def submit(self, func, args, callback, error):
+        """Run func(*args) in the pool, then callback(result) on the
+        event loop.
+
+        If the task fails (it raises, its result can't be pickled, or
+        its worker dies) or takes longer than TASK_TIMEOUT, error() is
+        called on the event loop instead. Python 2's pool has no error
+        callback, so the tasks are checked from the event loop.
+
+        Keyword arguments:
+        func (function) -- a module-level function (so it can be pickled)
+        args (tuple) -- its arguments
+        callback (function) -- what to do with the result
+        error (function) -- what to do if there isn't one
+        """
+
+        # only one of them is called, even if a task that timed out
+        # finishes after all
+        finished = []
+
+        def succeed(result):
+            if not finished:
+                finished.append(True)
+                callback(result)
+
+        def fail():
+            if not finished:
+                finished.append(True)
+                error()
+
+        result = self._pool.apply_async(
+            func, args, callback=lambda result: self._trigger.call(succeed, result))
+        self._pending.append((result, fail, default_timer() + TASK_TIMEOUT))
+
+    def _check_pending(self):
+        "Call error() for the tasks that failed or timed out."
+
+        now = default_timer()
+        if now - self._checked < CHECK_INTERVAL:
+            return
+        self._checked = now
+
+        pending = []
+        for (result, error, deadline) in self._pending:
+            if result.ready():
+                # the callback has already been queued if it succeeded
+                if not result.successful():
+                    error()
+            elif now > deadline:
+                error()
+            else:
+                pending.append((result, error, deadline))
+
+        self._pending = pending
+
+    def handle_request(self, conn, method, path, query, body):
+        """Route a request. The response is sent with conn.respond().
+
+        Keyword arguments:
+        conn (_Connection) -- the client's connection
+        method (str) -- the HTTP method
+        path (str) -- the URL path
+        query (dict) -- the query string, from parse_qs()
+        body (str) -- the request body
+        """
+
+        match = _route.match(path)
+        if match is None:
+            return conn.respond(404)
+
+        gen = int(match.group(1))
+        action = match.group(2)
+
+        try:
+            if action == 'search':
+                species = int(query['species'][0])
+                count = int(query.get('count', [SEARCH_COUNT])[0])
+            else:
+                pid = int(query['pid'][0])
+        except (KeyError, ValueError):
+            return conn.respond(400)
+
+        if action == 'search':
+            if method != 'GET':
+                return conn.respond(405)
+            return conn.respond(200, self.search(gen, species, count))
+
+        if action == 'result':
+            if method != 'GET':
+                return conn.respond(405)
+            deposit = self.deposits[gen].get(pid)
+            if deposit is None:
+                return conn.respond(404)
+            return conn.respond(200, deposit[1])
+
+        if method == 'DELETE':
+            return conn.respond(200 if self.withdraw(gen, pid) else 404)
+
+        if method != 'POST':
+            return conn.respond(405)
+        if len(body) != CLIENT_SIZES[gen]:
+            return conn.respond(400)
+
+        def done(result):
+            (species, data, error) = result
+            if error is not None:
+                return conn.respond(400, error)
+            self.deposit(gen, pid, species, data)
+            conn.respond(200)
+
+        self.submit(decode_upload, (gen, body), done, lambda: conn.respond(500))
+
+    def deposit(self, gen, pid, species, data):
+        """Store a deposit, replacing the player's earlier one.
+
+        Keyword arguments:
+        gen (int) -- the game generation
+        pid (int) -- the player's ID
+        species (int) -- the deposited Pokémon's national dex ID
+        data (str) -- its server data
+        """
+
+        self.withdraw(gen, pid)
+        self.deposits[gen][pid] = (species, data)
+        self._species[gen].setdefault(species, OrderedDict())[pid] = data
+
+    def withdraw(self, gen, pid):
+        """Remove a player's deposit. Returns whether there was one.
+
+        Keyword arguments:
+        gen (int) -- the game generation
+        pid (int) -- the player's ID
+        """
+
+        deposit = self.deposits[gen].pop(pid, None)
+        if deposit is None:
+            return False
+
+        pids = self._species[gen][deposit[0]]
+        del pids[pid]
+        if not pids:
+            del self._species[gen][deposit[0]]
+
+        return True
+
+    def search(self, gen, species, count=SEARCH_COUNT):
+        """Return the server data of the oldest deposits of a species.
+
+        Keyword arguments:
+        gen (int) -- the game generation
+        species (int) -- the national dex ID to search for
+        count (int) -- the most deposits to return
+        """
+
+        pids = self._species[gen].get(species, {})
+        found = []
+
+        for data in pids.itervalues():
+            if len(found) >= count:
+                break
+            found.append(data)
+
+        return ''.join(found)
+
+    def serve_forever(self, timeout=0.5):
+        "Handle requests until shutdown() is called."
+
+        self._running = True
+        try:
+            while self._running:
+                asyncore.loop(timeout, use_poll=True, map=self.map, count=1)
+                self._check_pending()
+        finally:
+            self._pool.terminate()
+            self._pool.join()
+            asyncore.close_all(self.map)
+
+    def shutdown(self):
+        "Stop serve_forever() (from any thread)."
+
+        self._running = False
+        self._trigger.wake()
+
+class _LoadClient(asyncore.dispatcher):
+    """One load-test connection, sending requests one after another
+    over keep-alive.
+
+    Keyword arguments:
+    test (LoadTest) -- the test it belongs to
+    pid (int) -- the player ID it deposits as
+    """
+
+    def __init__(self, test, pid):
+        asyncore.dispatcher.__init__(self, map=test.map)
+        self.test = test
+        self.pid = pid
+        self._in = ''
+        self._out = ''
+        self._start = None
+        self._length = None
+        self._waiting = False
+
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.connect(test.address)
+
+    def handle_connect(self):
+        self._send_next()
+
+    def _send_next(self):
+        request = self.test.next_request(self)
+        if request is None:
+            self.close()
+            return
+
+        (method, target, body) = request
+        head = [
+            '{} {} HTTP/1.1'.format(method, target),
+            'Host: {}:{}'.format(*self.test.address),
+            'Content-Length: {}'.format(len(body)),
+        ]
+        self._out = '\r\n'.join(head) + '\r\n\r\n' + body
+        self._start = default_timer()
+        self._waiting = True
+
+    def writable(self):
+        return bool(self._out) or not self.connected
+
+    def handle_write(self):
+        sent = self.send(self._out)
+        self._out = self._out[sent:]
+
+    def handle_read(self):
+        data = self.recv(65536)
+        if not data:
+            return
+        self._in += data
+
+        end = self._in.find('\r\n\r\n')
+        if end < 0:
+            return
+
+        if self._length is None:
+            head = self._in[:end].split('\r\n')
+            self._status = int(head[0].split(' ')[1])
+            self._length = 0
+            for line in head[1:]:
+                (name, value) = line.split(':', 1)
+                if name.lower() == 'content-length':
+                    self._length = int(value)
+
+        if len(self._in) < end + 4 + self._length:
+            return
+
+        self._in = self._in[(end + 4 + self._length):]
+        self._length = None
+        self._waiting = False
+        self.test.record(self._status, default_timer() - self._start)
+        self._send_next()
+
+    def _fail(self):
+        "Count the request in flight as failed."
+
+        if self._waiting:
+            self._waiting = False
+            self.test.record(None, default_timer() - self._start)
+
+    def handle_close(self):
+        self._fail()
+        self.close()
+
+    def handle_error(self):
+        self._fail()
+        self.close()
+
+class LoadTest(object):
+    """Hammer a GTS server with many concurrent connections.
+
+    Each connection deposits first, then picks its requests at random:
+    a new deposit, a search, or fetching its own deposit.
+
+    Keyword arguments:
+    address (tuple) -- the server's (host, port)
+    gen (int) -- the game generation
+    connections (int) -- the number of concurrent connections
+    requests (int) -- the total number of requests to send
+    deposit_ratio (float) -- the fraction of requests that deposit
+    search_ratio (float) -- the fraction of requests that search
+    records (int) -- the number of distinct Pokémon to upload
+    seed (int) -- the random seed
+    """
+
+    def __init__(self, address, gen=4, connections=100, requests=10000,
+                 deposit_ratio=0.2, search_ratio=0.1, records=50, seed=0):
+        from pypkm.bench import corpus
+
+        self.address = address
+        self.gen = gen
+        self.connections = connections
+        self.requests = requests
+        self.deposit_ratio = deposit_ratio
+        self.search_ratio = search_ratio
+        self.map = {}
+
+        self._random = random.Random(seed)
+        self._uploads = []
+        self._species = []
+        for data in corpus(gen, records, seed):
+            obj = get_pkmobj(gen, data)
+            self._uploads.append(obj.togtsclient().tostring())
+            self._species.append(obj.id)
+
+        self._sent = 0
+        self._deposited = set()
+        self.latencies = []
+        self.statuses = {}
+
+    def next_request(self, client):
+        "Return the next (method, target, body) to send, or None."
+
+        if self._sent >= self.requests:
+            return None
+        self._sent += 1
+
+        prefix = '/gen{}'.format(self.gen)
+        choice = self._random.random()
+
+        if client.pid not in self._deposited or choice < self.deposit_ratio:
+            self._deposited.add(client.pid)
+            return ('POST', '{}/deposit?pid={}'.format(prefix, client.pid),
+                    self._random.choice(self._uploads))
+
+        if choice < self.deposit_ratio + self.search_ratio:
+            species = self._random.choice(self._species)
+            return ('GET', '{}/search?species={}'.format(prefix, species), '')
+
+        return ('GET', '{}/result?pid={}'.format(prefix, client.pid), '')
+
+    def record(self, status, seconds):
+        "Record a finished request (a status of None is a failure)."
+
+        self.latencies.append(seconds)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def run(self):
+        """Send every request and return the results.
+
+        Returns a dict with the number of 'requests', the 'seconds'
+        taken, 'requests_per_sec', the latency percentiles in
+        milliseconds and the count of each status.
+        """
+
+        from pypkm.bench import percentile
+
+        start = default_timer()
+        for i in range(self.connections):
+            _LoadClient(self, i + 1)
+        asyncore.loop(timeout=1, use_poll=True, map=self.map)
+        elapsed = default_timer() - start
+
+        times = sorted(self.latencies)
+        result = {
+            'requests': len(times),
+            'seconds': elapsed,
+            'requests_per_sec': len(times) / elapsed if elapsed else 0.0,
+            'statuses': self.statuses,
+        }
+        for percent in (50, 90, 99, 99.9):
+            key = 'p{}_ms'.format(percent).replace('.', '_')
+            result[key] = percentile(times, percent) * 1000 if times else None
+        result['max_ms'] = times[-1] * 1000 if times else None
+
+        return result
+
+def _raise_fd_limit():
+    "Allow as many open files as we're permitted, for the connections."
+
+    try:
+        import resource
+        (soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError):
+        pass
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pypkm.gts',
+                                     description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command')
+
+    serve = commands.add_parser('serve', help='run the server')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8080)
+    serve.add_argument('--workers', type=int, help='default: one per CPU')
+    serve.add_argument('--threads', action='store_true',
+                       help='decode in threads instead of processes')
+
+    load = commands.add_parser('loadtest', help='load-test a running server')
+    load.add_argument('--host', default='127.0.0.1')
+    load.add_argument('--port', type=int, default=8080)
+    load.add_argument('--gen', type=int, choices=[4, 5], default=4)
+    load.add_argument('--connections', type=int, default=1000)
+    load.add_argument('--requests', type=int, default=20000)
+    load.add_argument('--deposit-ratio', type=float, default=0.2)
+    load.add_argument('--search-ratio', type=float, default=0.1)
+    load.add_argument('--seed', type=int, default=0)
+
+    args = parser.parse_args(argv)
+    _raise_fd_limit()
+
+    if args.command == 'serve':
+        server = GTSServer((args.host, args.port), args.workers, not args.threads)
+        print('serving on {}:{}'.format(*server.address))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    test = LoadTest((args.host, args.port), args.gen, args.connections, args.requests,
+                    args.deposit_ratio, args.search_ratio, seed=args.seed)
+    result = test.run()
+
+    print('{requests} requests in {seconds:.2f} s: {requests_per_sec:.0f} requests/s'.format(**result))
+    print('latency (ms): p50 {p50_ms:.2f}  p90 {p90_ms:.2f}  p99 {p99_ms:.2f}  '
+          'p99.9 {p99_9_ms:.2f}  max {max_ms:.2f}'.format(**result))
+    print('statuses: {}'.format(', '.join('{}: {}'.format(status or 'failed', count)
+                                          for (status, count) in sorted(result['statuses'].items()))))
+
+    failed = sum(count for (status, count) in result['statuses'].items()
+                 if status is None or status >= 500)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+# coding=utf-8
+
+"""Defer importing a module until one of its attributes is used.
+
+Building the Construct structs for a generation, opening the reference
+database and importing NumPy all take time, and most programs only need
+some of them. A module imported with lazy_import() is only loaded the
+first time it's used:
+
+    >>> gen5 = lazy_import('pypkm.structs.gen5')
+    >>> gen5.pkm_struct # pypkm.structs.gen5 is imported here
+
+when_imported() runs a function once a module has been imported, so
+code that patches a module doesn't have to import it early.
+"""
+
+__author__ = 'Patrick Jacobs <ceolwulf@gmail.com>'
+
+import imp
+import sys
+
+class LazyModule(object):
+    """A stand-in for a module that imports it on first use.
+
+    Keyword arguments:
+    name (str) -- the module's full dotted name
+    """
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+
+        if module is None:
+            name = self.__dict__['_name']
+            __import__(name)
+            module = sys.modules[name]
+            self.__dict__['_module'] = module
+
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        return '<lazy module {!r}>'.format(self.__dict__['_name'])
+
+def lazy_import(name, optional=False):
+    """Return a module that's imported the first time it's used.
+
+    If the module is already imported, it's returned as it is.
+
+    Keyword arguments:
+    name (str) -- the module's full dotted name
+    optional (bool) -- return None if a top-level module isn't
+        installed, like `try: import ... except ImportError`
+    """
+
+    if name in sys.modules:
+        return sys.modules[name]
+
+    if optional:
+        try:
+            imp.find_module(name.split('.')[0])
+        except ImportError:
+            return None
+
+    return LazyModule(name)
+
+# The functions to call when a module is imported, keyed by its name
+_import_hooks = {}
+
+class _ImportHookFinder(object):
+    "Calls the hooks of a module after the usual import of it."
+
+    def __init__(self):
+        self._loading = set()
+
+    def find_module(self, name, path=None):
+        if name in _import_hooks and name not in self._loading:
+            return self
+
+        return None
+
+    def load_module(self, name):
+        if name in sys.modules:
+            return sys.modules[name]
+
+        self._loading.add(name)
+        try:
+            __import__(name)
+        finally:
+            self._loading.discard(name)
+
+        module = sys.modules[name]
+        hooks = _import_hooks.pop(name, ())
+        if not _import_hooks and self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+        for hook in hooks:
+            hook(module)
+
+        return module
+
+_finder = _ImportHookFinder()
+
+def when_imported(name, hook):
+    """Call hook(module) once a module is imported.
+
+    If it's already imported, the hook is called straight away.
+
+    Keyword arguments:
+    name (str) -- the module's full dotted name
+    hook (function) -- the function to call with the module
+    """
+
+    if name in sys.modules:
+        hook(sys.modules[name])
+        return
+
+    _import_hooks.setdefault(name, []).append(hook)
+    if _finder not in sys.meta_path:
+        sys.meta_path.insert(0, _finder)
+
+def remove_import_hook(name, hook):
+    """Stop waiting to call a hook added with when_imported().
+
+    Does nothing if the hook has already been called.
+
+    Keyword arguments:
+    name (str) -- the module's full dotted name
+    hook (function) -- the hook to remove
+    """
+
+    hooks = _import_hooks.get(name, [])
+    if hook in hooks:
+        hooks.remove(hook)
+    if not hooks:
+        _import_hooks.pop(name, None)
+
+    if not _import_hooks and _finder in sys.meta_path:
+        sys.meta_path.remove(_finder)
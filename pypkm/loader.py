@@ -0,0 +1,166 @@
+# coding=utf-8
+
+"""Load PKM files in bulk.
+
+iter_load() walks a directory tree, a zip or tar archive, or a single
+file of concatenated records, and yields one PKM object at a time.
+Files are read with bounded buffers, so memory use stays the same no
+matter how large the source is.
+"""
+
+__author__ = 'Patrick Jacobs <ceolwulf@gmail.com>'
+
+import os
+import struct
+from pypkm.crypto import checksum
+from pypkm.lazy import lazy_import
+from pypkm.pkm import get_pkmobj, pkm_classes
+
+# only needed when reading from an archive
+tarfile = lazy_import('tarfile')
+zipfile = lazy_import('zipfile')
+
+# How many records to read from a dump at a time
+CHUNK_RECORDS = 512
+
+def _is_valid(data):
+    """Check the stored checksum of a decrypted PKM record.
+
+    Keyword arguments:
+    data (str) -- the record, at least 136 bytes long
+    """
+
+    return struct.unpack('<H', data[6:8])[0] == checksum(data[8:136])
+
+def _detect_record_size(f, gen):
+    """Work out the record size of a dump of concatenated records.
+
+    The dump's length has to be a multiple of the record size. If more
+    than one size fits, the PKM sizes whose first records have valid
+    checksums are tried. Returns None if the dump is empty.
+
+    Keyword arguments:
+    f (file) -- the dump, which must be seekable
+    gen (int) -- the records' game generation
+    """
+
+    start = f.tell()
+    f.seek(0, os.SEEK_END)
+    length = f.tell() - start
+    f.seek(start)
+
+    if length == 0:
+        return None
+
+    sizes = [size for size in sorted(pkm_classes[gen]) if length % size == 0]
+    if len(sizes) > 1:
+        head = f.read(max(sizes) * 2)
+        f.seek(start)
+
+        valid = []
+        for size in sizes:
+            records = [head[i:(i + size)] for i in range(0, min(len(head), size * 2), size)]
+            if size in (136, 220, 236) and all(_is_valid(record) for record in records):
+                valid.append(size)
+        sizes = valid
+
+    if len(sizes) != 1:
+        raise ValueError('cannot detect the record size; pass record_size')
+
+    return sizes[0]
+
+def _iter_dump(f, gen, lazy, record_size):
+    "Yield PKM objects from a file of concatenated records."
+
+    if record_size is None:
+        record_size = _detect_record_size(f, gen)
+        if record_size is None:
+            # an empty dump holds no records, like an empty directory
+            return
+
+    buf = ''
+    while True:
+        chunk = f.read(record_size * CHUNK_RECORDS)
+        if not chunk:
+            break
+
+        buf += chunk
+        end = len(buf) - (len(buf) % record_size)
+        for offset in range(0, end, record_size):
+            yield get_pkmobj(gen, buf[offset:(offset + record_size)], lazy)
+        buf = buf[end:]
+
+    if buf:
+        raise ValueError('dump ends with a partial {}-byte record'.format(record_size))
+
+def _iter_dump_file(path, gen, lazy, record_size):
+    "Open a dump and yield PKM objects from it."
+
+    with open(path, 'rb') as f:
+        for obj in _iter_dump(f, gen, lazy, record_size):
+            yield obj
+
+def _iter_directory(path, gen, lazy):
+    "Yield PKM objects from every file of a known size under a directory."
+
+    sizes = pkm_classes[gen]
+
+    for (dirpath, dirnames, filenames) in os.walk(path):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            filepath = os.path.join(dirpath, filename)
+            if os.path.isfile(filepath) and os.path.getsize(filepath) in sizes:
+                with open(filepath, 'rb') as f:
+                    yield get_pkmobj(gen, f.read(), lazy)
+
+def _iter_zip(path, gen, lazy):
+    "Yield PKM objects from every member of a known size in a zip file."
+
+    sizes = pkm_classes[gen]
+
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if info.file_size in sizes:
+                yield get_pkmobj(gen, archive.read(info), lazy)
+
+def _iter_tar(path, gen, lazy):
+    "Yield PKM objects from every member of a known size in a tar file."
+
+    sizes = pkm_classes[gen]
+
+    # stream mode reads the archive front to back without seeking
+    archive = tarfile.open(path, 'r|*')
+    try:
+        for info in archive:
+            if info.isfile() and info.size in sizes:
+                yield get_pkmobj(gen, archive.extractfile(info).read(), lazy)
+            # don't keep every member's header around
+            archive.members = []
+    finally:
+        archive.close()
+
+def iter_load(source, gen, lazy=False, record_size=None):
+    """Load PKM data from a directory, archive or dump, one at a time.
+
+    Directories and archives are searched for files whose length is a
+    known record size for the generation; anything else is skipped.
+    Any other file (or file object) is read as concatenated records.
+
+    Keyword arguments:
+    source (str or file) -- a directory, zip/tar archive or dump
+    gen (int) -- the files' game generation
+    lazy (bool) -- yield lazily-parsed objects (see pypkm.load())
+    record_size (int) -- the record size of a dump (detected if None)
+    """
+
+    if not isinstance(source, basestring):
+        return _iter_dump(source, gen, lazy, record_size)
+
+    if os.path.isdir(source):
+        return _iter_directory(source, gen, lazy)
+    if zipfile.is_zipfile(source):
+        return _iter_zip(source, gen, lazy)
+    if tarfile.is_tarfile(source):
+        return _iter_tar(source, gen, lazy)
+
+    return _iter_dump_file(source, gen, lazy, record_size)
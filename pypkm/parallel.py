@@ -0,0 +1,259 @@
+# coding=utf-8
+
+"""Convert PKM data in parallel with a process pool.
+
+Every conversion (toparty(), togtsserver(), togtsclient(), togen5()
+and topkm()) is CPU-bound, so converting a large dump one object at a
+time only uses one core. convert() splits the records into chunks and
+hands them to a pool of worker processes. Workers receive and return
+raw byte data, which is much cheaper to send between processes than
+pickled Container objects.
+
+Example usage:
+    >>> from pypkm.parallel import convert
+    >>> for data in convert(records, gen=4, conversion='toparty'):
+    ...     out.write(data)
+"""
+
+__author__ = 'Patrick Jacobs <ceolwulf@gmail.com>'
+
+import os
+import multiprocessing
+import traceback
+from collections import OrderedDict
+from multiprocessing.queues import SimpleQueue
+from timeit import default_timer
+from pypkm.pkm import get_pkmobj
+
+CONVERSIONS = ('toparty', 'togtsserver', 'togtsclient', 'togen5', 'topkm')
+
+# How often (in seconds) convert() checks on chunks it's waiting for
+POLL_INTERVAL = 0.1
+
+class ConversionError(Exception):
+    """A record that couldn't be converted.
+
+    Keyword arguments:
+    index (int) -- the record's position in the input
+    details (str) -- the worker's traceback
+    """
+
+    def __init__(self, index, details):
+        message = 'record {} failed to convert:\n{}'.format(index, details)
+        Exception.__init__(self, message)
+
+        self.index = index
+        self.details = details
+
+# In a worker process, the queue that _convert_chunk() reports each
+# chunk it starts on (so we know which worker has it)
+_started = None
+
+def _init_worker(started):
+    global _started
+
+    _started = started
+
+def _convert_chunk(gen, conversion, number, start, records):
+    """Convert a chunk of records (run in a worker process).
+
+    Returns the chunk number and start index along with a list of
+    (succeeded, data or traceback) pairs.
+    """
+
+    if _started is not None:
+        _started.put((number, os.getpid()))
+
+    results = []
+
+    for data in records:
+        try:
+            obj = getattr(get_pkmobj(gen, data), conversion)()
+            results.append((True, obj.tostring()))
+        except Exception:
+            results.append((False, traceback.format_exc()))
+
+    return (number, start, results)
+
+def _tostring(data):
+    "Copy a record into a str, which is all a worker can be sent."
+
+    if isinstance(data, memoryview):
+        return data.tobytes()
+
+    return str(data)
+
+def _chunked(records, chunksize):
+    "Split an iterable of records into lists of chunksize records."
+
+    chunk = []
+
+    for data in records:
+        chunk.append(_tostring(data))
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+class _Task(object):
+    """A chunk sent to the pool.
+
+    Keyword arguments:
+    start (int) -- the index of its first record
+    size (int) -- the number of records
+    result (AsyncResult) -- the result from apply_async()
+    """
+
+    def __init__(self, start, size, result):
+        self.start = start
+        self.size = size
+        self.result = result
+        self.submitted = default_timer()
+        # the worker's pid, once it's started, and when it was found dead
+        self.worker = None
+        self.died = None
+
+    def failed(self, details):
+        "Return (start, results) with every record failed."
+
+        return (self.start, [(False, details)] * self.size)
+
+    def poll(self, workers, timeout):
+        """Return (start, results) if the chunk is done or has failed,
+        otherwise None.
+
+        Keyword arguments:
+        workers (set) -- the pids of the live workers
+        timeout (float) -- the longest a chunk may take, or None
+        """
+
+        if self.result.ready():
+            try:
+                (number, start, results) = self.result.get()
+            except Exception:
+                # e.g. the results couldn't be pickled
+                return self.failed(traceback.format_exc())
+            return (start, results)
+
+        now = default_timer()
+
+        if self.worker is not None and self.worker not in workers:
+            # give its result a moment to arrive in case it finished
+            # just before it died
+            if self.died is None:
+                self.died = now
+            elif now - self.died > POLL_INTERVAL:
+                return self.failed('worker {} died while converting'.format(self.worker))
+
+        if timeout is not None and now - self.submitted > timeout:
+            return self.failed('timed out after {} seconds'.format(timeout))
+
+        return None
+
+def _results(start, results, errors):
+    "Yield the converted data of a chunk, handling failures."
+
+    for (i, (succeeded, payload)) in enumerate(results):
+        if succeeded:
+            yield payload
+        elif errors == 'capture':
+            yield ConversionError(start + i, payload)
+        elif errors == 'raise':
+            raise ConversionError(start + i, payload)
+
+def convert(records, gen, conversion, processes=None, chunksize=64,
+            ordered=True, errors='raise', timeout=None):
+    """Convert raw records in parallel, yielding the converted data.
+
+    Only a few chunks per worker are sent ahead at a time, so records
+    can be streamed from a generator (like pypkm.loader's) without
+    reading them all into memory.
+
+    If a worker dies while converting a chunk (or a chunk takes longer
+    than `timeout`), each of its records fails like any other record.
+
+    Keyword arguments:
+    records (iterable) -- the raw data of each record
+    gen (int) -- the records' game generation
+    conversion (str) -- the method to call, e.g. 'toparty'
+    processes (int) -- the number of workers (default: one per CPU);
+        0 converts in this process without a pool
+    chunksize (int) -- the number of records sent to a worker at once
+    ordered (bool) -- yield results in input order; if False, chunks
+        are yielded as soon as they're done
+    errors (str) -- what to do when a record fails: 'raise' raises a
+        ConversionError, 'capture' yields the ConversionError in place
+        of the data and 'skip' leaves the record out
+    timeout (float) -- the most seconds to wait for a chunk, counted
+        from when it's sent to the pool (default: no limit)
+    """
+
+    if conversion not in CONVERSIONS:
+        raise ValueError('unknown conversion: {}'.format(conversion))
+    if errors not in ('raise', 'capture', 'skip'):
+        raise ValueError('unknown error handling: {}'.format(errors))
+
+    chunks = enumerate(_chunked(records, chunksize))
+
+    if processes == 0:
+        for (number, chunk) in chunks:
+            (number, start, results) = _convert_chunk(gen, conversion, number,
+                                                      number * chunksize, chunk)
+            for data in _results(start, results, errors):
+                yield data
+        return
+
+    # written to without a feeder thread, so a worker's report gets
+    # through even if the worker dies right after
+    started = SimpleQueue()
+    pool = multiprocessing.Pool(processes, _init_worker, (started,))
+    max_inflight = (processes or multiprocessing.cpu_count()) * 4
+
+    # chunk number -> _Task, in the order they were sent
+    pending = OrderedDict()
+    exhausted = False
+
+    try:
+        while True:
+            while not exhausted and len(pending) < max_inflight:
+                try:
+                    (number, chunk) = next(chunks)
+                except StopIteration:
+                    exhausted = True
+                    break
+                start = number * chunksize
+                result = pool.apply_async(_convert_chunk,
+                                          (gen, conversion, number, start, chunk))
+                pending[number] = _Task(start, len(chunk), result)
+
+            if not pending:
+                break
+
+            # waiting with a timeout keeps us interruptible
+            next(pending.itervalues()).result.wait(POLL_INTERVAL)
+
+            while not started.empty():
+                (number, pid) = started.get()
+                if number in pending:
+                    pending[number].worker = pid
+
+            workers = set(process.pid for process in multiprocessing.active_children())
+
+            for (number, task) in pending.items():
+                done = task.poll(workers, timeout)
+                if done is None:
+                    if ordered:
+                        break
+                    continue
+
+                del pending[number]
+                for data in _results(done[0], done[1], errors):
+                    yield data
+
+        pool.close()
+    finally:
+        # stops the workers if we're done early or something failed
+        pool.terminate()
+        pool.join()
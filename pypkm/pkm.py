@@ -6,97 +6,306 @@ __author__ = 'Patrick Jacobs <ceolwulf@gmail.com>'
 
 import datetime
 import struct
-from pypkm.structs import gen4, gen5
+from construct import Container
 from pypkm.crypto import checksum, encrypt, decrypt
-from pypkm.sqlite import get_level, get_nature, get_basestats
-from pypkm.util import calcstat, LengthError
-        
+from pypkm.lazy import lazy_import
+from pypkm.util import calcstat, field_names, LengthError
 
-class StructData(object):
-    """A wrapper class for the construct Container object."""
+# Each generation's structs are only built when a class first needs
+# them, and the database is only opened when a lookup is made
+gen4 = lazy_import('pypkm.structs.gen4')
+gen5 = lazy_import('pypkm.structs.gen5')
+sqlite = lazy_import('pypkm.sqlite')
+compiler = lazy_import('pypkm.compiler')
+
+# How StructData parses and builds data: 'construct' interprets the
+# Struct definitions, 'compiled' uses the struct-module codecs that
+# pypkm.compiler generates from them (see set_backend())
+backend = 'construct'
+
+def set_backend(name):
+    """Choose how PKM and GTS data is parsed and built.
+
+    Keyword arguments:
+    name (str) -- 'construct' or 'compiled'
+    """
+
+    global backend
+
+    if name not in ('construct', 'compiled'):
+        raise ValueError('unknown backend: {}'.format(name))
+
+    backend = name
+
+def _backend(strc):
+    "Return the parser/builder to use for a Struct."
+
+    if backend == 'compiled':
+        return compiler.compile_struct(strc)
+
+    return strc
+
+# Maps of field name -> (offset, block Struct) for each lazily-loaded
+# struct, keyed by the struct's id
+_field_maps = {}
+
+def _field_map(strc, blocks):
+    """Return which block each of a struct's fields is found in.
+
+    Keyword arguments:
+    strc (construct.Struct) -- the whole struct
+    blocks (tuple) -- (offset, Struct) pairs that make up the struct
+    """
+
+    fields = _field_maps.get(id(strc))
 
-    # Constructor Struct object
-    _strc = None
+    if fields is None:
+        fields = {}
+        for (offset, block) in blocks:
+            for name in field_names(block):
+                fields.setdefault(name, (offset, block))
+        _field_maps[id(strc)] = fields
 
-    # Construct Container object
-    _ctnr = None
+    return fields
+
+class StructData(object):
+    """A wrapper class for the construct Container objects of a struct.
+
+    The original data is kept, and each block of it is parsed into its
+    own Container. In lazy mode, a block is only parsed the first time
+    one of its fields is read.
+
+    tostring() only re-encodes the blocks that have been modified, so
+    the rest of the data (trash bytes and all) comes back unchanged. A
+    block is modified when one of its fields is set, or when one of its
+    nested Containers (like `ivs` or `moves`) has been read and no
+    longer matches the data.
+    """
+
+    # The current data, the block each field is in (name -> (offset,
+    # Struct)) and the Containers of the blocks parsed so far (keyed
+    # by offset)
+    _data = None
+    _blocks = None
+    _fields = None
+    _block_ctnrs = None
+
+    # The offsets of blocks that have had a field set, and of blocks
+    # that have handed out a nested Container which may be changed
+    _dirty = None
+    _touched = None
 
     def __getattr__(self, attr):
-        return getattr(self._ctnr, attr)
+        if self._fields is not None and attr in self._fields:
+            (offset, block) = self._fields[attr]
+            value = getattr(self._block(offset, block), attr)
+            if isinstance(value, (Container, list)):
+                self._touched.add(offset)
+            return value
+
+        raise AttributeError(attr)
     
     def __setattr__(self, attr, value):
-        if hasattr(self._ctnr, attr):
-            setattr(self._ctnr, attr, value)
+        if self._fields is not None and attr in self._fields:
+            (offset, block) = self._fields[attr]
+            setattr(self._block(offset, block), attr, value)
+            self._dirty.add(offset)
         else:
             self.__dict__[attr] = value
     
-    def _load(self, strc, data):
-        self._strc = strc
-        self._ctnr = self._strc.parse(data)
+    def _load(self, strc, data, lazy=False, blocks=None):
+        if blocks is None:
+            blocks = ((0x00, strc),)
+        
+        self._data = data
+        self._blocks = blocks
+        self._fields = _field_map(strc, blocks)
+        self._block_ctnrs = {}
+        self._dirty = set()
+        self._touched = set()
+
+        if not lazy:
+            for (offset, block) in blocks:
+                self._block(offset, block)
     
+    def _parse_block(self, offset, block):
+        "Parse a single block of the current data."
+
+        block = _backend(block)
+        size = block.sizeof()
+
+        return block.parse(self._data[offset:(offset + size)])
+
+    def _build_block(self, block, ctnr):
+        "Encode a block's Container."
+
+        return _backend(block).build(ctnr)
+
+    def _block(self, offset, block):
+        "Return the Container of a block, parsing it if needed."
+
+        ctnr = self._block_ctnrs.get(offset)
+
+        if ctnr is None:
+            ctnr = self._parse_block(offset, block)
+            self._block_ctnrs[offset] = ctnr
+
+        return ctnr
+    
+    def _changes(self):
+        "Re-encode each modified block, as (offset, data) pairs."
+
+        changes = []
+
+        for (offset, block) in self._blocks:
+            if offset in self._dirty:
+                pass
+            elif offset in self._touched:
+                # only re-encode it if a nested Container was changed
+                if self._block_ctnrs[offset] == self._parse_block(offset, block):
+                    continue
+            else:
+                continue
+
+            changes.append((offset, self._build_block(block, self._block_ctnrs[offset])))
+
+        return changes
+
+    def _update(self, changes):
+        "Write re-encoded blocks into the data."
+
+        pieces = []
+        position = 0
+
+        for (offset, block_data) in changes:
+            pieces.append(self._data[position:offset])
+            pieces.append(block_data)
+            position = offset + len(block_data)
+        pieces.append(self._data[position:])
+
+        self._data = ''.join(pieces)
+
     def tostring(self):
-        data = self._strc.build(self._ctnr)
+        changes = self._changes()
 
-        return data
+        if changes:
+            self._update(changes)
+        self._dirty.clear()
+
+        return self._data
 
 class PkmData(StructData):
-    """A base class for Pokémon data."""
+    """A base class for Pokémon data.
+
+    The checksum is the sum of the 16-bit words from 0x08 to 0x88 (the
+    four encrypted blocks; party data isn't included). It's calculated
+    once, on the first tostring(), and then kept up to date from the
+    old and new words of each re-encoded block.
+    """
+
+    _chksum = None
+
+    def _update(self, changes):
+        if self._chksum is not None:
+            chksum = self._chksum
+            for (offset, block_data) in changes:
+                if 0x08 <= offset and offset + len(block_data) <= 0x88:
+                    old_data = self._data[offset:(offset + len(block_data))]
+                    chksum += checksum(block_data) - checksum(old_data)
+            self._chksum = chksum & 0xFFFF
+
+        super(PkmData, self)._update(changes)
     
     def tostring(self):
         data = super(PkmData, self).tostring()
 
-        # we need to recalculate the checksum when we build...
-        # since building removes any trash bytes in the nickname and
-        # ot name fields, if you're just reading the file, you should
-        # store the loaded data instead of using tostring()
-        chksum = checksum(data[0x08:])
-        packed = struct.pack('<H', chksum)
-        data = ''.join([
-            data[:0x06],
-            packed,
-            data[0x08:],
-        ])
+        if self._chksum is None:
+            self._chksum = checksum(data[0x08:0x88])
+
+        # the stored checksum is always replaced with the right one
+        packed = struct.pack('<H', self._chksum)
+        if data[0x06:0x08] != packed:
+            data = ''.join([
+                data[:0x06],
+                packed,
+                data[0x08:],
+            ])
+            self._data = data
+
+            ctnr = self._block_ctnrs.get(0x00)
+            if ctnr is not None:
+                ctnr.checksum = self._chksum
 
         return data
 
+    def _toparty(self, party_cls, battle_block):
+        """Append battle data to the box data in a single pass.
+
+        The level and stats are calculated from the fields we've
+        already decoded, and the new object's battle block is filled
+        in from them, so the party data never needs to be re-parsed.
+
+        Keyword arguments:
+        party_cls (class) -- the party class to return
+        battle_block (tuple) -- the (offset, Struct) of the battle block
+        """
+
+        data = self.tostring()[:136]
+
+        level = sqlite.get_level(pokemon_id=self.id, exp=self.exp)
+        nature = sqlite.get_nature(self.pv % 25)
+        base_stats = sqlite.get_basestats(pokemon_id=self.id)
+        (ivs, evs) = (self.ivs, self.evs)
+
+        hp = calcstat(iv=ivs.hp, ev=evs.hp, base=base_stats[0],
+                      level=level, nature_stat=None)
+        stats = Container(
+            current_hp=hp,
+            max_hp=hp,
+            attack=calcstat(iv=ivs.attack, ev=evs.attack, base=base_stats[1],
+                            level=level, nature_stat=nature[2]),
+            defense=calcstat(iv=ivs.defense, ev=evs.defense, base=base_stats[2],
+                             level=level, nature_stat=nature[3]),
+            speed=calcstat(iv=ivs.speed, ev=evs.speed, base=base_stats[3],
+                           level=level, nature_stat=nature[4]),
+            spattack=calcstat(iv=ivs.spattack, ev=evs.spattack, base=base_stats[4],
+                              level=level, nature_stat=nature[5]),
+            spdefense=calcstat(iv=ivs.spdefense, ev=evs.spdefense, base=base_stats[5],
+                               level=level, nature_stat=nature[6]),
+        )
+
+        battle = Container(
+            status=Container(toxic=False, paralyzed=False, frozen=False,
+                             burned=False, poisoned=False, asleep_rounds=0),
+            x89=0,
+            level=level,
+            capsule_index=0,
+            stats=stats,
+            trash_data='\x00' * 56,
+        )
+
+        (offset, block) = battle_block
+        data = ''.join([data, self._build_block(block, battle)])
+
+        # the box blocks are parsed if and when they're used
+        new_pkm = party_cls(data, lazy=True)
+        new_pkm._block_ctnrs[offset] = battle
+
+        return new_pkm
+
 class Gen4BoxPkm(PkmData):
 
-    def __init__(self, data=None):
+    def __init__(self, data=None, lazy=False):
         if data is None:
             data = '\x00' * 136
         elif len(data) != 136:
             raise LengthError(136, len(data))
         
-        self._load(gen4.pkm_struct, data)
+        self._load(gen4.pkm_struct, data, lazy, gen4.pkm_blocks)
     
     def toparty(self):
         # even if it's already a party file, we should process it
-        data = self.tostring()[:136]
-        
-        # create empty data to load into Struct
-        data = ''.join([data, '\x00' * 100])
-        new_pkm = Gen4PartyPkm(data)
-
-        new_pkm.level = get_level(pokemon_id=new_pkm.id, exp=new_pkm.exp)
-
-        nature = get_nature(new_pkm.pv % 25)
-        base_stats = get_basestats(pokemon_id=new_pkm.id)
-
-        new_pkm.stats.current_hp = calcstat(iv=new_pkm.ivs.hp, ev=new_pkm.evs.hp, base=base_stats[0],
-                              level=new_pkm.level, nature_stat=None)
-        new_pkm.stats.max_hp = new_pkm.stats.current_hp
-        new_pkm.stats.attack = calcstat(iv=new_pkm.ivs.attack, ev=new_pkm.evs.attack, base=base_stats[1],
-                            level=new_pkm.level, nature_stat=nature[2])
-        new_pkm.stats.defense = calcstat(iv=new_pkm.ivs.defense, ev=new_pkm.evs.defense, base=base_stats[2],
-                            level=new_pkm.level, nature_stat=nature[3])
-        new_pkm.stats.speed = calcstat(iv=new_pkm.ivs.speed, ev=new_pkm.evs.speed, base=base_stats[3],
-                            level=new_pkm.level, nature_stat=nature[4])
-        new_pkm.stats.spattack = calcstat(iv=new_pkm.ivs.spattack, ev=new_pkm.evs.spattack, base=base_stats[4],
-                            level=new_pkm.level, nature_stat=nature[5])
-        new_pkm.stats.spdefense = calcstat(iv=new_pkm.ivs.spdefense, ev=new_pkm.evs.spdefense, base=base_stats[5],
-                            level=new_pkm.level, nature_stat=nature[6])
-        
-        return new_pkm
+        return self._toparty(Gen4PartyPkm, gen4.pkm_party_blocks[-1])
     
     def togtsserver(self):
         # have to do this in case our old data isn't party
@@ -112,7 +321,7 @@ class Gen4BoxPkm(PkmData):
         data = encrypt(obj.tostring())
 
         # create empty data to load into Struct
-        gts = Gen4ServerPkm('\x00' * 292)
+        gts = Gen4ServerData('\x00' * 292)
 
         gts.encrypted_pkm = data
 
@@ -179,7 +388,7 @@ class Gen4BoxPkm(PkmData):
         data = encrypt(obj.tostring())
 
         # create empty data to load into Struct
-        gts = Gen4ClientPkm('\x00' * 296)
+        gts = Gen4ClientData('\x00' * 296)
 
         gts.encrypted_pkm = data
 
@@ -264,52 +473,27 @@ class Gen4BoxPkm(PkmData):
 
 class Gen4PartyPkm(Gen4BoxPkm):
     
-    def __init__(self, data=None):
+    def __init__(self, data=None, lazy=False):
         if data is None:
             data = '\x00' * 236
         elif len(data) != 236:
             raise LengthError(236, len(data))
         
-        self._load(gen4.pkm_party_struct, data)
+        self._load(gen4.pkm_party_struct, data, lazy, gen4.pkm_party_blocks)
     
 class Gen5BoxPkm(PkmData):
 
-    def __init__(self, data=None):
+    def __init__(self, data=None, lazy=False):
         if data is None:
             data = '\x00' * 136
         elif len(data) != 136:
             raise LengthError(136, len(data))
         
-        self._load(gen5.pkm_struct, data)
+        self._load(gen5.pkm_struct, data, lazy, gen5.pkm_blocks)
     
     def toparty(self):
         # even if it's already a party file, we should process it
-        data = self.tostring()[:136]
-        
-        # create empty data to load into Struct
-        data = ''.join([data, '\x00' * 100])
-        new_pkm = Gen5PartyPkm(data)
-
-        new_pkm.level = get_level(pokemon_id=new_pkm.id, exp=new_pkm.exp)
-
-        nature = get_nature(new_pkm.pv % 25)
-        base_stats = get_basestats(pokemon_id=new_pkm.id)
-
-        new_pkm.stats.current_hp = calcstat(iv=new_pkm.ivs.hp, ev=new_pkm.evs.hp, base=base_stats[0],
-                              level=new_pkm.level, nature_stat=None)
-        new_pkm.stats.max_hp = new_pkm.stats.current_hp
-        new_pkm.stats.attack = calcstat(iv=new_pkm.ivs.attack, ev=new_pkm.evs.attack, base=base_stats[1],
-                            level=new_pkm.level, nature_stat=nature[2])
-        new_pkm.stats.defense = calcstat(iv=new_pkm.ivs.defense, ev=new_pkm.evs.defense, base=base_stats[2],
-                            level=new_pkm.level, nature_stat=nature[3])
-        new_pkm.stats.speed = calcstat(iv=new_pkm.ivs.speed, ev=new_pkm.evs.speed, base=base_stats[3],
-                            level=new_pkm.level, nature_stat=nature[4])
-        new_pkm.stats.spattack = calcstat(iv=new_pkm.ivs.spattack, ev=new_pkm.evs.spattack, base=base_stats[4],
-                            level=new_pkm.level, nature_stat=nature[5])
-        new_pkm.stats.spdefense = calcstat(iv=new_pkm.ivs.spdefense, ev=new_pkm.evs.spdefense, base=base_stats[5],
-                            level=new_pkm.level, nature_stat=nature[6])
-        
-        return new_pkm
+        return self._toparty(Gen5PartyPkm, gen5.pkm_party_blocks[-1])
     
     def togtsserver(self):
         # have to do this in case our old data isn't party
@@ -325,7 +509,7 @@ class Gen5BoxPkm(PkmData):
         data = encrypt(obj.tostring())
 
         # create empty data to load into Struct
-        gts = Gen5ServerPkm('\x00' * 296)
+        gts = Gen5ServerData('\x00' * 296)
 
         gts.encrypted_pkm = data
 
@@ -393,7 +577,7 @@ class Gen5BoxPkm(PkmData):
         data = encrypt(obj.tostring())
 
         # create empty data to load into Struct
-        gts = Gen5ClientPkm('\x00' * 444)
+        gts = Gen5ClientData('\x00' * 444)
 
         gts.encrypted_pkm = data
 
@@ -456,13 +640,13 @@ class Gen5BoxPkm(PkmData):
 
 class Gen5PartyPkm(Gen5BoxPkm):
     
-    def __init__(self, data=None):
+    def __init__(self, data=None, lazy=False):
         if data is None:
             data = '\x00' * 220
         elif len(data) != 220:
             raise LengthError(220, len(data))
         
-        self._load(gen5.pkm_party_struct, data)
+        self._load(gen5.pkm_party_struct, data, lazy, gen5.pkm_party_blocks)
 
 class GTSData(StructData):
     """A base class for data sent to or from the GTS server."""
@@ -470,13 +654,13 @@ class GTSData(StructData):
 
 class Gen4ServerData(GTSData):
     
-    def __init__(self, data=None):
+    def __init__(self, data=None, lazy=False):
         if data is None:
             data = '\x00' * 292
         elif len(data) != 292:
             raise LengthError(292, len(data))
         
-        self._load(gen4.pkm_gtsserver_struct, data)
+        self._load(gen4.pkm_gtsserver_struct, data, lazy)
     
     def topkm(self):
         data = decrypt(self.encrypted_pkm)
@@ -485,13 +669,13 @@ class Gen4ServerData(GTSData):
 
 class Gen4ClientData(GTSData):
     
-    def __init__(self, data=None):
+    def __init__(self, data=None, lazy=False):
         if data is None:
             data = '\x00' * 296
         elif len(data) != 296:
             raise LengthError(296, len(data))
         
-        self._load(gen4.pkm_gtsclient_struct, data)
+        self._load(gen4.pkm_gtsclient_struct, data, lazy)
     
     def topkm(self):
         data = decrypt(self.encrypted_pkm)
@@ -500,13 +684,13 @@ class Gen4ClientData(GTSData):
 
 class Gen5ServerData(GTSData):
     
-    def __init__(self, data=None):
+    def __init__(self, data=None, lazy=False):
         if data is None:
             data = '\x00' * 296
         elif len(data) != 296:
             raise LengthError(296, len(data))
         
-        self._load(gen5.pkm_gtsserver_struct, data)
+        self._load(gen5.pkm_gtsserver_struct, data, lazy)
     
     def topkm(self):
         data = decrypt(self.encrypted_pkm)
@@ -515,33 +699,34 @@ class Gen5ServerData(GTSData):
 
 class Gen5ClientData(GTSData):
     
-    def __init__(self, data=None):
+    def __init__(self, data=None, lazy=False):
         if data is None:
             data = '\x00' * 444
         elif len(data) != 444:
             raise LengthError(444, len(data))
         
-        self._load(gen5.pkm_gtsclient_struct, data)
+        self._load(gen5.pkm_gtsclient_struct, data, lazy)
     
     def topkm(self):
         data = decrypt(self.encrypted_pkm)
 
         return Gen5PartyPkm(data)
 
-def get_pkmobj(gen, data):
-    objs = {
-        4: {
-            136: Gen4BoxPkm,
-            236: Gen4PartyPkm,
-            292: Gen4ServerData,
-            296: Gen4ClientData,
-        },
-        5: {
-            136: Gen5BoxPkm,
-            220: Gen5PartyPkm,
-            296: Gen5ServerData,
-            444: Gen5ClientData,
-        }
+# The class to load data with, by generation and length
+pkm_classes = {
+    4: {
+        136: Gen4BoxPkm,
+        236: Gen4PartyPkm,
+        292: Gen4ServerData,
+        296: Gen4ClientData,
+    },
+    5: {
+        136: Gen5BoxPkm,
+        220: Gen5PartyPkm,
+        296: Gen5ServerData,
+        444: Gen5ClientData,
     }
-    
-    return objs.get(gen).get(len(data))(data)
+}
+
+def get_pkmobj(gen, data, lazy=False):
+    return pkm_classes.get(gen).get(len(data))(data, lazy=lazy)
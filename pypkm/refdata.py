@@ -0,0 +1,74 @@
+# coding=utf-8
+
+"""In-memory copies of the PyPKM reference tables.
+
+The tables in the PyPKM SQLite database are tiny (a few hundred rows
+each) but are read several times for every Pokémon converted, so they
+are loaded once into dicts and lists and looked up from there instead
+of running a query each time.
+"""
+
+__author__ = "Patrick Jacobs <ceolwulf@gmail.com>"
+
+from bisect import bisect_right
+
+class ReferenceData(object):
+    """Every reference table, loaded from a database cursor.
+
+    Keyword arguments:
+    db (sqlite3.Cursor) -- a cursor on the PyPKM database
+    """
+
+    def __init__(self, db):
+        # national dex ID -> growth rate ID
+        self.growth_rates = dict(db.execute(
+            'SELECT `pokemon_id`, `growth_rate_id` FROM `pokemon_growth_rates`'
+        ))
+
+        # growth rate ID -> experience needed for levels 1 to 100, in
+        # order, so a level can be found with a binary search
+        self.experience = {}
+        query = 'SELECT `growth_rate_id`, `experience` FROM `levels` ORDER BY `growth_rate_id`, `level`'
+        for (growth_id, exp) in db.execute(query):
+            self.experience.setdefault(growth_id, []).append(exp)
+
+        # nature ID -> (id, name, atk, def, spe, spa, spd)
+        self.natures = {}
+        query = 'SELECT `id`, `name`, `atk`, `def`, `spe`, `spa`, `spd` FROM `natures`'
+        for row in db.execute(query):
+            self.natures[row[0]] = row
+
+        # (national dex ID, form) -> (hp, atk, def, spe, spa, spd)
+        self.base_stats = {}
+        query = 'SELECT `pokemon_id`, `pokemon_form_id`, `base_hp`, `base_atk`, `base_def`, `base_spe`, `base_spa`, `base_spd` FROM `pokemon_base_stats`'
+        for row in db.execute(query):
+            self.base_stats[(row[0], row[1])] = row[2:]
+
+        # gen 4 character table, in both directions
+        self.characters = {}
+        self.ordinals = {}
+        query = 'SELECT `id`, `character` FROM `character_table` ORDER BY `id`'
+        for (ord_, chr_) in db.execute(query):
+            self.characters[ord_] = chr_
+            # the first ordinal wins if a character appears twice
+            self.ordinals.setdefault(chr_, ord_)
+
+    def level(self, growth_id, exp):
+        """Find the highest level reached with the given experience.
+
+        Keyword arguments:
+        growth_id (int) -- the growth rate ID
+        exp (int) -- the experience points
+        """
+
+        return bisect_right(self.experience[growth_id], exp)
+
+    def exp(self, growth_id, level):
+        """Find the experience needed to reach a level.
+
+        Keyword arguments:
+        growth_id (int) -- the growth rate ID
+        level (int) -- the level (1-100)
+        """
+
+        return self.experience[growth_id][level - 1]
@@ -21,10 +21,66 @@ by an AND mask to force the number to the last 32 (or 64) bits. The
 other modification to the function is the addition of a right shift to
 the created seed on return but not when the created seed replaces the
 old seed.
+
+Because each step is an affine function of the seed, any number of
+steps can be collapsed into a single (multiplier, increment) pair by
+repeated squaring. This lets the RNG jump millions of frames ahead (or
+behind, using the modular inverse of the multiplier) in a few dozen
+multiplications.
+
+find_seeds() goes the other way, from a Pokémon's PV and IVs back to
+the seeds that could have created them, and generate_pvs() and
+generate_spreads() list the PVs (and seeds and IVs) that meet a set of
+constraints like nature and shininess.
 """
 
 __author__ = "Patrick Jacobs <ceolwulf@gmail.com>"
 
+import random
+from collections import deque
+
+def _inverse(mult, mask):
+    """Calculate the inverse of an odd multiplier modulo (mask + 1).
+
+    Each Newton iteration doubles the number of correct low bits, and
+    an odd number is always its own inverse modulo 8.
+
+    Keyword arguments:
+    mult (int) -- the LC RNG multiplier
+    mask (int) -- the LC RNG mask (a power of two minus one)
+    """
+
+    inverse = mult
+    for i in range(0, 5):
+        inverse = (inverse * (2 - (mult * inverse))) & mask
+
+    return inverse
+
+def _compose(mult, add, steps, mask):
+    """Collapse `steps` applications of a step into a single step.
+
+    Returns the (multiplier, increment) of the combined step.
+
+    Keyword arguments:
+    mult (int) -- the multiplier of a single step
+    add (int) -- the increment of a single step
+    steps (int) -- the number of times to apply the step
+    mask (int) -- the LC RNG mask
+    """
+
+    jump_mult = 1
+    jump_add = 0
+
+    while steps > 0:
+        if steps & 1:
+            jump_mult = (jump_mult * mult) & mask
+            jump_add = ((jump_add * mult) + add) & mask
+        add = (add * (mult + 1)) & mask
+        mult = (mult * mult) & mask
+        steps >>= 1
+
+    return (jump_mult, jump_add)
+
 class Rng(object):
     """Base class for the linear congruent random number generator.
     
@@ -33,8 +89,8 @@ class Rng(object):
     pseudo-random number generator.
     """
     
-    # Store every iteration of the LC RNG.
-    frames = []
+    # Recent iterations of the LC RNG (see __init__).
+    frames = None
     
     seed = 0
     
@@ -44,9 +100,17 @@ class Rng(object):
     add = 0
     mask = 0xFFFFFFFF
     width = 0x10
+    outmask = 0xFFFF
     
-    def __init__(self):
-        pass
+    def __init__(self, history=0):
+        """Set up the frame history.
+
+        Keyword arguments:
+        history (int) -- the number of frames to remember; 0 keeps no
+            history and None keeps every frame
+        """
+
+        self.frames = deque(maxlen=history)
     
     def _advance(self):
         "Calculate the next LC RNG step."
@@ -56,23 +120,79 @@ class Rng(object):
         self.seed += self.add
         self.seed &= self.mask
         
-        return self.seed >> self.width
+        return (self.seed >> self.width) & self.outmask
+    
+    def _frame(self):
+        "Return the frame of the current seed."
+
+        return (self.seed >> self.width) & self.outmask
+    
+    def _jump(self, mult, add, steps):
+        """Move the seed by applying the given step `steps` times.
+
+        The step is squared on every pass, so this runs in O(log n)
+        rather than calculating each frame in between.
+
+        Keyword arguments:
+        mult (int) -- the multiplier of a single step
+        add (int) -- the increment of a single step
+        steps (int) -- the number of times to apply the step
+        """
+
+        (jump_mult, jump_add) = _compose(mult, add, steps, self.mask)
+
+        self.seed = ((self.seed * jump_mult) + jump_add) & self.mask
     
     def advance(self, steps=1):
-        "Advance the LC RNG the specified number of steps."
+        """Advance the LC RNG the specified number of steps.
+
+        Only the final frame is calculated (and stored in the frame
+        history); the frames in between are skipped over with a single
+        jump. Advancing 0 steps returns the current frame and leaves
+        the seed alone, and a negative number of steps reverses.
+        """
         
-        for i in range(0, steps):
-            self.frames.append(self._advance())
+        if steps < 0:
+            return self.reverse(-steps)
+        if steps == 0:
+            return self._frame()
+
+        if steps > 1:
+            self._jump(self.mult, self.add, steps - 1)
+
+        frame = self._advance()
+        self.frames.append(frame)
         
-        return self.frames[-1]
+        return frame
     
     def _reverse(self):
         "Calculate the previous LC RNG step."
-        pass
+
+        self.seed -= self.add
+        self.seed *= _inverse(self.mult, self.mask)
+        self.seed &= self.mask
+
+        return (self.seed >> self.width) & self.outmask
     
-    def reverse(self, steps):
-        "Reverse the LC RNG the specified number of steps."
-        pass
+    def reverse(self, steps=1):
+        """Reverse the LC RNG the specified number of steps.
+
+        Returns the frame of the seed the LC RNG lands on, so reversing
+        one step after an advance() returns the frame before it.
+        Reversing 0 steps returns the current frame and leaves the seed
+        alone, and a negative number of steps advances.
+        """
+
+        if steps < 0:
+            return self.advance(-steps)
+        if steps == 0:
+            return self._frame()
+
+        if steps > 1:
+            inverse = _inverse(self.mult, self.mask)
+            self._jump(inverse, (-self.add * inverse) & self.mask, steps - 1)
+
+        return self._reverse()
 
 class Prng(Rng):
     """Widely-used extension of the base LC RNG.
@@ -83,8 +203,8 @@ class Prng(Rng):
     PRNG.
     """
     
-    def __init__(self, seed=0):
-        super(Prng, self).__init__()
+    def __init__(self, seed=0, history=0):
+        super(Prng, self).__init__(history)
 
         self.seed = seed
         self.mult = 0x41C64E6D
@@ -98,8 +218,8 @@ class Arng(Rng):
     order to force it back to normal color. Kept in for posterity.
     """
     
-    def __init__(self, seed=0):
-        super(Arng, self).__init__()
+    def __init__(self, seed=0, history=0):
+        super(Arng, self).__init__(history)
 
         self.seed = seed
         self.mult = 0x6C078965
@@ -111,16 +231,14 @@ class Grng(Rng):
     This LC RNG is seeded with the checksum and 
     """
 
-    def __init__(self, seed=0):
-        super(Grng, self).__init__()
+    def __init__(self, seed=0, history=0):
+        super(Grng, self).__init__(history)
 
         self.seed = seed | (seed << 16)
         self.mult = 0x45
         self.add = 0x1111
         self.mask = 0x7FFFFFFF
-    
-    def _advance(self):
-        return (super(Grng, self)._advance()) & 0xFF
+        self.outmask = 0xFF
 
 class Mtrng(Rng):
     """Mersenne Twister wrapper.
@@ -130,8 +248,267 @@ class Mtrng(Rng):
     egg's PV is created.
     """
     
-    def __init__(self, seed=0):
+    def __init__(self, seed=0, history=0):
+        super(Mtrng, self).__init__(history)
+
         random.seed(seed)
-    
+
     def _advance(self):
-        return random.randint(0x00, self.mask)
\ No newline at end of file
+        return random.randint(0x00, self.mask)
+
+# The PRNG calls (counted in steps from the origin seed) that make up a
+# wild Pokémon's (PV low, PV high, IV1, IV2) for each method. Method 2
+# skips a call before the IVs, and method 4 skips one between them.
+METHODS = {
+    1: (1, 2, 3, 4),
+    2: (1, 2, 4, 5),
+    4: (1, 2, 3, 5),
+}
+
+class _LowBitTable(object):
+    """Recovers a seed from the top 16 bits of it and of a later seed.
+
+    If X = (high << 16) | low and Y = (mult * X + add) & 0xFFFFFFFF,
+    the top 16 bits of Y are those of (mult * (high << 16) + add) plus
+    those of (mult * low), plus a carry of 0 or 1. So knowing both
+    outputs pins the top 16 bits of (mult * low) down to two values,
+    and the (one or two, on average) lows that give them are looked up
+    rather than trying all 65536.
+
+    Keyword arguments:
+    mult (int) -- the multiplier between the two seeds
+    add (int) -- the increment between the two seeds
+    """
+
+    def __init__(self, mult, add):
+        self.mult = mult
+        self.add = add
+
+        # top 16 bits of (mult * low) -> lows
+        self.lows = {}
+        for low in range(0x10000):
+            self.lows.setdefault(((mult * low) >> 16) & 0xFFFF, []).append(low)
+
+    def seeds(self, high, next_high):
+        """Yield every seed with the top 16 bits `high` whose later
+        seed has the top 16 bits `next_high`."""
+
+        base = ((self.mult * (high << 16)) + self.add) & 0xFFFFFFFF
+        target = (next_high - (base >> 16)) & 0xFFFF
+
+        for key in (target, (target - 1) & 0xFFFF):
+            for low in self.lows.get(key, ()):
+                seed = (high << 16) | low
+                if (((self.mult * seed) + self.add) & 0xFFFFFFFF) >> 16 == next_high:
+                    yield seed
+
+# Low bit tables, keyed by the number of steps between the two seeds
+_low_bit_tables = {}
+
+def _low_bit_table(steps):
+    "Return the low bit table for seeds `steps` PRNG calls apart."
+
+    table = _low_bit_tables.get(steps)
+
+    if table is None:
+        lc = Prng()
+        table = _LowBitTable(*_compose(lc.mult, lc.add, steps, lc.mask))
+        _low_bit_tables[steps] = table
+
+    return table
+
+def _iv_words(ivs):
+    """Pack six IVs (in the order of util.STATS) into the 15 bits of
+    the two PRNG calls they come from."""
+
+    (hp, attack, defense, speed, spattack, spdefense) = ivs
+
+    return (hp | (attack << 5) | (defense << 10),
+            speed | (spattack << 5) | (spdefense << 10))
+
+def find_seeds(pkm=None, pv=None, ivs=None, method=1):
+    """Find every origin seed that produces a PV and/or IVs.
+
+    The origin seed is the PRNG seed before the first call of the
+    method (the low half of the PV). Rather than trying all 2^32
+    seeds, candidates are read from a lookup table (see _LowBitTable)
+    using two outputs the Pokémon gives us, then checked against the
+    rest.
+
+    Returns the matching seeds, sorted.
+
+    Keyword arguments:
+    pkm (PkmData) -- a Pokémon to read the PV and IVs from
+    pv (int) -- the personality value
+    ivs (sequence) -- the six IVs, in the order of util.STATS
+    method (int) -- the PID/IV method (1, 2 or 4)
+    """
+
+    if pkm is not None:
+        pv = pkm.pv
+        ivs = [pkm.ivs.hp, pkm.ivs.attack, pkm.ivs.defense,
+               pkm.ivs.speed, pkm.ivs.spattack, pkm.ivs.spdefense]
+
+    if method not in METHODS:
+        raise ValueError('unknown method: {}'.format(method))
+    if pv is None and ivs is None:
+        raise ValueError('need a pv or ivs to search with')
+
+    calls = METHODS[method]
+    wanted = {}
+
+    if pv is not None:
+        wanted[calls[0]] = (pv & 0xFFFF, 0xFFFF)
+        wanted[calls[1]] = (pv >> 16, 0xFFFF)
+    if ivs is not None:
+        (iv1, iv2) = _iv_words(ivs)
+        # the top bit of each IV call isn't used
+        wanted[calls[2]] = (iv1, 0x7FFF)
+        wanted[calls[3]] = (iv2, 0x7FFF)
+
+    # the candidates come from the two PV calls if we have them
+    if pv is not None:
+        (first, second) = (calls[0], calls[1])
+        pairs = [(pv & 0xFFFF, pv >> 16)]
+    else:
+        (first, second) = (calls[2], calls[3])
+        pairs = [(iv1 | top1, iv2 | top2) for top1 in (0, 0x8000) for top2 in (0, 0x8000)]
+
+    table = _low_bit_table(second - first)
+    lc = Prng()
+    inverse = _inverse(lc.mult, lc.mask)
+    (back_mult, back_add) = _compose(inverse, (-lc.add * inverse) & lc.mask, first, lc.mask)
+
+    seeds = set()
+
+    for (high, next_high) in pairs:
+        for seed in table.seeds(high, next_high):
+            origin = ((seed * back_mult) + back_add) & lc.mask
+
+            # check every output we know about
+            rng = Prng(origin)
+            for step in range(1, calls[-1] + 1):
+                frame = rng._advance()
+                if step in wanted:
+                    (value, mask) = wanted[step]
+                    if frame & mask != value:
+                        break
+            else:
+                seeds.add(int(origin))
+
+    return sorted(seeds)
+
+def _ivs(iv1, iv2):
+    "Unpack the IVs (in the order of util.STATS) from two PRNG calls."
+
+    return (iv1 & 0x1F, (iv1 >> 5) & 0x1F, (iv1 >> 10) & 0x1F,
+            iv2 & 0x1F, (iv2 >> 5) & 0x1F, (iv2 >> 10) & 0x1F)
+
+# Which low halves of a PV are allowed, keyed by the (gender,
+# gender_ratio, ability) constraints
+_pv_tables = {}
+
+def _pv_table(gender, gender_ratio, ability):
+    """Return the inverse tables for the low half of a PV.
+
+    The gender and ability only depend on the low byte of the PV, so
+    the allowed low halves are listed once, grouped by their residue
+    mod 25 (the nature of (high << 16) | low is (11 * high + low) % 25,
+    since 65536 % 25 == 11). Returns the groups and a bytearray that
+    flags every allowed low half.
+
+    Keyword arguments:
+    gender (str) -- 'male', 'female' or None
+    gender_ratio (int) -- PVs with a low byte under this are female
+    ability (int) -- the ability bit (0 or 1), or None
+    """
+
+    key = (gender, gender_ratio, ability)
+    table = _pv_tables.get(key)
+
+    if table is None:
+        by_residue = [[] for i in range(25)]
+        allowed = bytearray(0x10000)
+
+        for low in range(0x10000):
+            if gender == 'female' and (low & 0xFF) >= gender_ratio:
+                continue
+            if gender == 'male' and (low & 0xFF) < gender_ratio:
+                continue
+            if ability is not None and (low & 1) != ability:
+                continue
+            by_residue[low % 25].append(low)
+            allowed[low] = 1
+
+        table = (by_residue, allowed)
+        _pv_tables[key] = table
+
+    return table
+
+def generate_pvs(nature=None, gender=None, gender_ratio=0x7F, ability=None,
+                 shiny=None, ot_id=0, ot_secret_id=0):
+    """Yield every PV that meets the constraints, in increasing order.
+
+    Rather than trying random PVs, the valid ones are read from
+    inverse tables: the low halves are grouped by nature residue (see
+    _pv_table()), and a shiny PV's high half is one of the eight
+    values low ^ ot_id ^ ot_secret_id ^ (0 to 7).
+
+    Keyword arguments:
+    nature (int) -- the nature ID (pv % 25), or None for any
+    gender (str) -- 'male', 'female' or None for either
+    gender_ratio (int) -- the species' gender threshold: a PV is
+        female if its low byte is under it (e.g. 0x1F, 0x3F, 0x7F, 0xBF)
+    ability (int) -- the ability bit (pv & 1), or None for either
+    shiny (bool) -- True for only shiny PVs, False for none, or None
+    ot_id (int) -- the trainer ID (for shininess)
+    ot_secret_id (int) -- the trainer's secret ID (for shininess)
+    """
+
+    if gender not in (None, 'male', 'female'):
+        raise ValueError('unknown gender: {}'.format(gender))
+
+    (by_residue, allowed) = _pv_table(gender, gender_ratio, ability)
+    trainer = ot_id ^ ot_secret_id
+
+    if nature is None:
+        # every residue, merged back into order
+        every = sorted(low for group in by_residue for low in group)
+
+    for high in range(0x10000):
+        if shiny:
+            lows = sorted(low for low in (high ^ trainer ^ i for i in range(8))
+                          if allowed[low])
+            if nature is not None:
+                lows = [low for low in lows if (11 * high + low) % 25 == nature]
+        elif nature is not None:
+            lows = by_residue[(nature - 11 * high) % 25]
+        else:
+            lows = every
+
+        for low in lows:
+            if shiny is False and (high ^ low ^ trainer) < 8:
+                continue
+            yield (high << 16) | low
+
+def generate_spreads(method=1, **constraints):
+    """Yield (seed, pv, ivs) for every PV that meets the constraints.
+
+    The PVs come from generate_pvs() (which takes the same keyword
+    arguments), each origin seed that produces a PV comes from
+    find_seeds(), and the IVs are the ones that seed goes on to make.
+
+    Keyword arguments:
+    method (int) -- the PID/IV method (1, 2 or 4)
+    """
+
+    if method not in METHODS:
+        raise ValueError('unknown method: {}'.format(method))
+
+    calls = METHODS[method]
+
+    for pv in generate_pvs(**constraints):
+        for seed in find_seeds(pv=pv, method=method):
+            rng = Prng(seed)
+            frames = [None] + [rng._advance() for step in range(calls[-1])]
+            yield (seed, pv, _ivs(frames[calls[2]], frames[calls[3]]))
@@ -0,0 +1,296 @@
+# coding=utf-8
+
+"""Read Pokémon from Generation 4 and 5 save files.
+
+A save file is memory-mapped rather than read, and each box slot or
+party slot is only sliced out and decrypted the first time it's used,
+so reading one Pokémon from a 512 KB save doesn't touch the others.
+
+Gen 4 saves hold two copies of the game data, one in each 256 KB half
+of the file. Each copy is split into a general block (which holds the
+party) and a storage block (which holds the boxes), and the game often
+only writes one of them, so the active copy of each block is picked
+separately: the one with the higher save counter in its own footer.
+Gen 5 saves are read from the primary copy.
+
+Example usage:
+    >>> from pypkm.savefile import SaveFile
+    >>> save = SaveFile('/path/to/game.sav')
+    >>> save.boxes[0][0].id
+    387
+    >>> [pkm.level for pkm in save.party]
+    [38, 36, 35]
+
+@see http://projectpokemon.org/wiki/Pokemon_NDS_Structure
+"""
+
+__author__ = 'Patrick Jacobs <ceolwulf@gmail.com>'
+
+import mmap
+import struct
+from pypkm.crypto import decrypt
+from pypkm.pkm import get_pkmobj
+
+class SaveLayout(object):
+    """Where everything is in one game's save file.
+
+    Keyword arguments:
+    gen (int) -- the game generation
+    general_size (int) -- the size of the general (small) block
+    footer_size (int) -- the size of each block's footer, which starts
+        with the save counter and is followed by the block size
+    party_offset (int) -- the first party record (the count is the
+        32-bit word before it)
+    storage_offset (int) -- where the storage (big) block starts
+    storage_size (int) -- the size of the storage block
+    box_offset (int) -- the first box record
+    box_stride (int) -- the distance between the start of each box
+    box_count (int) -- the number of boxes
+    partitions (int) -- how many copies of the save are in the file
+    """
+
+    slots = 30
+    partition_size = 0x40000
+    # the size of every Gen 4 and Gen 5 save, and the most an emulator
+    # appends to it
+    file_size = 0x80000
+    trailer_size = 0x400
+
+    def __init__(self, gen, general_size, footer_size, party_offset,
+                 storage_offset, storage_size, box_offset, box_stride,
+                 box_count, partitions):
+        self.gen = gen
+        self.general_size = general_size
+        self.footer_size = footer_size
+        self.party_offset = party_offset
+        self.storage_offset = storage_offset
+        self.storage_size = storage_size
+        self.box_offset = box_offset
+        self.box_stride = box_stride
+        self.box_count = box_count
+        self.partitions = partitions
+
+    @property
+    def party_size(self):
+        return 236 if self.gen == 4 else 220
+
+    def _block(self, storage):
+        "Return the (offset, size) of the general or storage block."
+
+        if storage:
+            return (self.storage_offset, self.storage_size)
+
+        return (0, self.general_size)
+
+    def save_counter(self, data, partition, storage=False):
+        "Read the save counter of a copy of the general or storage block."
+
+        (offset, size) = self._block(storage)
+        offset += (partition * self.partition_size) + size - self.footer_size
+
+        return struct.unpack_from('<L', data, offset)[0]
+
+    def matches(self, data, partition, storage=False):
+        "Check the block size stored in a copy of a block's footer."
+
+        (offset, size) = self._block(storage)
+        offset += (partition * self.partition_size) + size - self.footer_size + 4
+        if len(data) < offset + 8:
+            return False
+
+        return size in struct.unpack_from('<LL', data, offset)
+
+    def party_count(self, data, partition=0):
+        "Read the number of Pokémon in a copy's party."
+
+        offset = (partition * self.partition_size) + self.party_offset - 4
+
+        return struct.unpack_from('<L', data, offset)[0]
+
+    def is_valid(self, data):
+        """Check that data looks like a save file from this game.
+
+        Gen 4 saves need a footer with the right block size. Gen 5
+        footers aren't checked, so the file has to be the size of a
+        save and have a party of at most six.
+        """
+
+        if self.gen == 4:
+            return any(self.matches(data, i) for i in range(self.partitions))
+
+        if not self.file_size <= len(data) <= self.file_size + self.trailer_size:
+            return False
+
+        return self.party_count(data) <= 6
+
+# Layouts by game, in the order they're tried when detecting
+layouts = {
+    'dp': SaveLayout(4, general_size=0xC100, footer_size=0x14,
+                     party_offset=0x98, storage_offset=0xC100,
+                     storage_size=0x121E0, box_offset=0xC104,
+                     box_stride=0xFF0, box_count=18, partitions=2),
+    'pt': SaveLayout(4, general_size=0xCF2C, footer_size=0x14,
+                     party_offset=0xA0, storage_offset=0xCF2C,
+                     storage_size=0x121E4, box_offset=0xCF30,
+                     box_stride=0xFF0, box_count=18, partitions=2),
+    'hgss': SaveLayout(4, general_size=0xF628, footer_size=0x10,
+                       party_offset=0x98, storage_offset=0xF700,
+                       storage_size=0x12310, box_offset=0xF700,
+                       box_stride=0x1000, box_count=18, partitions=2),
+    'bw': SaveLayout(5, general_size=0x24000, footer_size=0x10,
+                     party_offset=0x18E08, storage_offset=0,
+                     storage_size=0x24000, box_offset=0x400,
+                     box_stride=0x1000, box_count=24, partitions=1),
+}
+
+def detect_game(data, gen=None):
+    """Work out which game a save file is from.
+
+    Gen 4 saves are recognised by the block size in their footers, and
+    Black/White saves by their size (see SaveLayout.is_valid()).
+
+    Keyword arguments:
+    data (str or mmap) -- the save file data
+    gen (int) -- optionally limit the search to one generation
+    """
+
+    for game in ('dp', 'pt', 'hgss', 'bw'):
+        layout = layouts[game]
+        if gen not in (None, layout.gen):
+            continue
+        if layout.is_valid(data):
+            return game
+
+    raise ValueError('cannot detect the game; pass game')
+
+class _Slots(object):
+    """A lazily-decrypted sequence of encrypted PKM records.
+
+    Empty slots (all zero bytes) are returned as None.
+    """
+
+    def __init__(self, save, offset, count, size):
+        self._save = save
+        self._offset = offset
+        self._count = count
+        self._size = size
+        self._cache = {}
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('slot index out of range')
+
+        if index not in self._cache:
+            self._cache[index] = self._save._load(self._offset + (index * self._size), self._size)
+
+        return self._cache[index]
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self[index]
+
+class _Boxes(object):
+    "The boxes of a save file, each a sequence of slots."
+
+    def __init__(self, save, layout, base):
+        self._boxes = [
+            _Slots(save, base + layout.box_offset + (i * layout.box_stride), layout.slots, 136)
+            for i in range(layout.box_count)
+        ]
+
+    def __len__(self):
+        return len(self._boxes)
+
+    def __getitem__(self, index):
+        return self._boxes[index]
+
+    def __iter__(self):
+        return iter(self._boxes)
+
+class SaveFile(object):
+    """A memory-mapped Gen 4 or Gen 5 save file.
+
+    `boxes[i][j]` and `party[k]` are lazily-parsed PKM objects, which
+    are only decrypted when first accessed.
+
+    Keyword arguments:
+    path (str) -- the .sav file to open
+    gen (int) -- the game generation (detected if None)
+    game (str) -- 'dp', 'pt', 'hgss' or 'bw' (detected if None)
+    partition (int) -- which copy of the save to read both blocks
+        from (the copy of each block with the highest save counter if
+        None)
+    """
+
+    def __init__(self, path, gen=None, game=None, partition=None):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            self._open(gen, game, partition)
+        except Exception:
+            self._map.close()
+            raise
+
+    def _open(self, gen, game, partition):
+        if game is None:
+            game = detect_game(self._map, gen)
+
+        self.game = game
+        self.layout = layouts[game]
+        self.gen = self.layout.gen
+
+        # the copies of the general block (the party) and of the
+        # storage block (the boxes) that are read
+        if partition is None:
+            self.partition = self._active_partition(storage=False)
+            self.storage_partition = self._active_partition(storage=True)
+        else:
+            self.partition = self.storage_partition = partition
+
+        base = self.storage_partition * self.layout.partition_size
+        self.boxes = _Boxes(self, self.layout, base)
+
+        base = self.partition * self.layout.partition_size
+        count = self.layout.party_count(self._map, self.partition)
+        self.party = _Slots(self, base + self.layout.party_offset, min(count, 6),
+                            self.layout.party_size)
+
+    def _active_partition(self, storage):
+        """Pick the copy of a block with the highest save counter.
+
+        Keyword arguments:
+        storage (bool) -- the storage block rather than the general one
+        """
+
+        layout = self.layout
+        copies = [i for i in range(layout.partitions)
+                  if (i + 1) * layout.partition_size <= len(self._map)]
+        if len(copies) < 2:
+            return 0
+
+        return max(copies, key=lambda i: (layout.matches(self._map, i, storage),
+                                          layout.save_counter(self._map, i, storage)))
+
+    def _load(self, offset, size):
+        "Decrypt and load the record at offset, or None if it's empty."
+
+        data = self._map[offset:(offset + size)]
+        if data.count('\x00') == size:
+            return None
+
+        return get_pkmobj(self.gen, decrypt(data), lazy=True)
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,29 +1,147 @@
 # coding=utf-8
 
-"A small wrapper for the PyPKM SQLite database."
+"""A small wrapper for the PyPKM SQLite database.
+
+sqlite3 connections can only be used by the thread that opened them,
+so each thread gets its own connection from a pool. The database is
+never written to, so connections are opened read-only and (when SQLite
+understands URI filenames) immutable, which skips file locking.
+"""
 
 __author__ = "Patrick Jacobs <ceolwulf@gmail.com>"
 
 import os
 import sqlite3
+import threading
+from pypkm.refdata import ReferenceData
 
 this_dir = os.path.dirname(os.path.abspath(__file__))
-db_conn = None
+db_path = os.path.join(this_dir, 'data/pypkm.sqlite')
+ref_data = None
+_ref_data_lock = threading.Lock()
+
+# The number of prepared statements each connection keeps
+STATEMENT_CACHE = 128
+
+def _uri_arguments():
+    """Return the extra sqlite3.connect() arguments needed to open a
+    URI filename, or None if URIs aren't supported."""
+
+    try:
+        sqlite3.connect(':memory:', uri=True).close()
+        return {'uri': True}
+    except TypeError:
+        # python 2's connect() has no uri argument, but SQLite still
+        # reads URIs if it was built to
+        conn = sqlite3.connect(':memory:')
+        options = [row[0] for row in conn.execute('PRAGMA compile_options')]
+        conn.close()
+        if 'USE_URI' in options or 'USE_URI=1' in options:
+            return {}
+
+    return None
+
+class ConnectionPool(object):
+    """One read-only database connection per thread.
+
+    Each connection caches its prepared statements, so repeating a
+    query from the same thread doesn't compile it again.
+
+    Keyword arguments:
+    path (str) -- the database file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # thread ident -> connection, so they can all be closed
+        self._connections = {}
+        self._uri_arguments = None
+
+    def _connect(self):
+        if self._uri_arguments is None:
+            self._uri_arguments = _uri_arguments() or False
+
+        # connections are only shared with close(), from another thread
+        kwargs = {'check_same_thread': False, 'cached_statements': STATEMENT_CACHE}
+
+        if self._uri_arguments is False:
+            conn = sqlite3.connect(self.path, **kwargs)
+            conn.execute('PRAGMA query_only = 1')
+            return conn
+
+        import urllib
+
+        kwargs.update(self._uri_arguments)
+        uri = 'file:{}?mode=ro&immutable=1'.format(urllib.pathname2url(self.path))
+
+        return sqlite3.connect(uri, **kwargs)
+
+    def connection(self):
+        "Return this thread's connection, opening it on first use."
+
+        conn = getattr(self._local, 'conn', None)
+
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+
+            with self._lock:
+                # close the connections of threads that have finished
+                alive = set(thread.ident for thread in threading.enumerate())
+                for ident in list(self._connections):
+                    if ident not in alive:
+                        self._connections.pop(ident).close()
+                self._connections[threading.current_thread().ident] = conn
+
+        return conn
+
+    def cursor(self):
+        "Return a new cursor on this thread's connection."
+
+        return self.connection().cursor()
+
+    def close(self):
+        "Close every thread's connection."
+
+        with self._lock:
+            for conn in self._connections.values():
+                conn.close()
+            self._connections.clear()
+
+        # threads will reconnect the next time they need to
+        self._local = threading.local()
+
+pool = ConnectionPool(db_path)
 
 def get_cursor():
     """Return a SQLite cursor for queries.
 
-    Returns an old connection if one has been made before.
+    The cursor belongs to the calling thread's connection, which is
+    reused by every call from that thread.
     """
-    
-    global db_conn
-    
-    if db_conn is not None:
-        return db_conn.cursor()
-    
-    db_conn = sqlite3.connect(os.path.join(this_dir, 'data/pypkm.sqlite'))
-    
-    return get_cursor()
+
+    return pool.cursor()
+
+def get_refdata():
+    """Return the reference tables, loading them on first use.
+
+    Every lookup below reads from these in-memory tables rather than
+    querying the database.
+    """
+
+    global ref_data
+
+    if ref_data is None:
+        with _ref_data_lock:
+            # another thread may have loaded them while we waited
+            if ref_data is None:
+                db = get_cursor()
+                ref_data = ReferenceData(db)
+                db.close()
+
+    return ref_data
 
 def get_chr(ord_):
     """Retrieve a character from the gen 4 character table.
@@ -32,17 +150,7 @@ def get_chr(ord_):
     ord_ (int) -- the character's index
     """
 
-    db = get_cursor()
-
-    query = 'SELECT `character` FROM `character_table` WHERE `id` = ? LIMIT 1'
-    row = db.execute(query, (ord_,)).fetchone()
-
-    db.close()
-
-    if row is not None:
-        return row[0]
-    
-    return ''
+    return get_refdata().characters.get(ord_, '')
 
 def get_ord(chr_):
     """Retrieve an ordinal from the gen 4 character table.
@@ -51,17 +159,7 @@ def get_ord(chr_):
     chr_ (str) -- the ordinal's character
     """
 
-    db = get_cursor()
-
-    query = 'SELECT `id` FROM `character_table` WHERE `character` = ? LIMIT 1'
-    row = db.execute(query, (chr_,)).fetchone()
-
-    db.close()
-
-    if row is not None:
-        return row[0]
-    
-    return ''
+    return get_refdata().ordinals.get(chr_, '')
 
 def get_growthrate(pokemon_id):
     """Retrieve the growth rate ID of a Pokémon by its Dex ID.
@@ -70,14 +168,7 @@ def get_growthrate(pokemon_id):
     pokemon_id (int) -- the national dex ID of the Pokémon
     """
 
-    db = get_cursor()
-
-    query = 'SELECT `growth_rate_id` FROM `pokemon_growth_rates` WHERE `pokemon_id` = ?'
-    growth_id = db.execute(query, (pokemon_id,)).fetchone()[0]
-
-    db.close()
-
-    return growth_id
+    return get_refdata().growth_rates[pokemon_id]
 
 def get_level(pokemon_id, exp):
     """Retrieve the level of a Pokémon by their experience points.
@@ -87,18 +178,8 @@ def get_level(pokemon_id, exp):
     exp (int) -- the experience points of the Pokémon
     """
 
-    growth_id = get_growthrate(pokemon_id)
-
-    db = get_cursor()
-
-    # select the level that's closest to the pokemon's exp without
-    # going over
-    query = 'SELECT `level` FROM `levels` WHERE `growth_rate_id` = ? AND `experience` <= ? ORDER BY `experience` DESC LIMIT 1'
-    level = db.execute(query, (growth_id,exp)).fetchone()[0]
-
-    db.close()
-
-    return level
+    # the level that's closest to the pokemon's exp without going over
+    return get_refdata().level(get_growthrate(pokemon_id), exp)
 
 def get_exp(pokemon_id, level):
     """Retrieve the experiance points of a Pokémon by their level.
@@ -108,17 +189,7 @@ def get_exp(pokemon_id, level):
     level (int) -- the level of the Pokémon
     """
 
-    growth_id = get_growthrate(pokemon_id)
-
-    db = get_cursor()
-
-    # select the exp using the growth ID and level
-    query = 'SELECT `experience` FROM `levels` WHERE `growth_id` = ? AND `level` = ?'
-    exp = db.execute(query, (growth_id,level)).fetchone()[0]
-
-    db.close()
-
-    return exp
+    return get_refdata().exp(get_growthrate(pokemon_id), level)
 
 def get_nature(nature_id):
     """Retrieves a set of information about a nature.
@@ -127,14 +198,7 @@ def get_nature(nature_id):
     nature_id (int) -- the ID of the nature (0-24)
     """
 
-    db = get_cursor()
-
-    query = 'SELECT `id`, `name`, `atk`, `def`, `spe`, `spa`, `spd` FROM `natures` WHERE `id` = ?'
-    nature = db.execute(query, (nature_id,)).fetchone()
-
-    db.close()
-
-    return nature
+    return get_refdata().natures.get(nature_id)
 
 def get_basestats(pokemon_id, alt_form=0):
     """Retrieve base stats for a Pokémon.
@@ -144,9 +208,4 @@ def get_basestats(pokemon_id, alt_form=0):
     alt_form (int) -- the optional alternate form
     """
 
-    db = get_cursor()
-
-    query = 'SELECT `base_hp`, `base_atk`, `base_def`, `base_spe`, `base_spa`, `base_spd` FROM `pokemon_base_stats` WHERE `pokemon_id` = ? AND `pokemon_form_id` = ?'
-    base_stats = db.execute(query, (pokemon_id, alt_form)).fetchone()
-
-    return base_stats
\ No newline at end of file
+    return get_refdata().base_stats.get((pokemon_id, alt_form))
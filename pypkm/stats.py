@@ -0,0 +1,386 @@
+# coding=utf-8
+
+"""Count and time the stages that PKM data goes through.
+
+When a batch is slow, this shows whether the time goes to parsing and
+building the structs, the checksum, shuffling, the cipher, reference
+lookups or the string codecs. Nothing is measured until it's turned on:
+
+    >>> from pypkm import stats
+    >>> stats.enable()
+    >>> pkm.toparty().togtsserver()
+    >>> stats.snapshot()['parse']['mean_us']
+
+or only for one batch (in the current thread):
+
+    >>> with stats.measure() as batch:
+    ...     convert_everything()
+    >>> batch.snapshot()
+
+Each stage keeps a call count, the total, minimum and maximum time and
+a latency histogram. Hooks (see add_hook()) are called with every
+measurement, so they can be forwarded to another metrics system.
+
+Measuring works by swapping the functions of each stage for timed
+wrappers, and putting the originals back when it stops, so code runs
+exactly as fast as before while it's off. A stage's time includes any
+stages it calls into (parsing a nickname includes decoding it), but a
+stage that calls itself is only timed once.
+"""
+
+__author__ = 'Patrick Jacobs <ceolwulf@gmail.com>'
+
+import sys
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from timeit import default_timer
+from pypkm.lazy import when_imported, remove_import_hook
+
+STAGES = ('parse', 'build', 'checksum', 'shuffle', 'crypt', 'refdata', 'codec')
+
+# The functions timed for each stage, as (stage, module, class,
+# attribute). A function imported into another module by name has to
+# be wrapped there too.
+POINTS = (
+    ('parse', 'pypkm.pkm', 'StructData', '_parse_block'),
+    ('build', 'pypkm.pkm', 'StructData', '_build_block'),
+    ('checksum', 'pypkm.crypto', None, 'checksum'),
+    ('checksum', 'pypkm.pkm', None, 'checksum'),
+    ('checksum', 'pypkm.loader', None, 'checksum'),
+    ('checksum', 'pypkm.gts', None, 'checksum'),
+    ('checksum', 'pypkm.crypto', None, 'verify_checksums'),
+    ('shuffle', 'pypkm.crypto', None, '_shuffle'),
+    ('shuffle', 'pypkm.crypto', None, '_unshuffle'),
+    ('shuffle', 'pypkm.crypto', None, '_shuffle_records'),
+    ('shuffle', 'pypkm.crypto', None, '_shuffle_many'),
+    ('crypt', 'pypkm.crypto', None, '_crypt_box'),
+    ('crypt', 'pypkm.crypto', None, '_crypt_party'),
+    ('crypt', 'pypkm.crypto', None, '_box_keystreams'),
+    ('crypt', 'pypkm.crypto', None, '_keystreams'),
+    ('refdata', 'pypkm.sqlite', None, 'get_chr'),
+    ('refdata', 'pypkm.sqlite', None, 'get_ord'),
+    ('refdata', 'pypkm.sqlite', None, 'get_growthrate'),
+    ('refdata', 'pypkm.sqlite', None, 'get_level'),
+    ('refdata', 'pypkm.sqlite', None, 'get_exp'),
+    ('refdata', 'pypkm.sqlite', None, 'get_nature'),
+    ('refdata', 'pypkm.sqlite', None, 'get_basestats'),
+    ('codec', 'pypkm.adapters.gen4', 'PkmStringAdapter', '_encode'),
+    ('codec', 'pypkm.adapters.gen4', 'PkmStringAdapter', '_decode'),
+    ('codec', 'pypkm.adapters.gen5', 'PkmStringAdapter', '_encode'),
+    ('codec', 'pypkm.adapters.gen5', 'PkmStringAdapter', '_decode'),
+)
+
+# The upper bounds of the histogram buckets, in microseconds. The last
+# bucket holds everything slower.
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000,
+           10000, 20000, 50000, 100000)
+
+class StageStats(object):
+    "The count, times and latency histogram of one stage."
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+        self.buckets[bisect_left(BUCKETS, seconds * 1e6)] += 1
+
+    def percentile(self, percent):
+        """Estimate a percentile (in microseconds) from the histogram.
+
+        Returns the upper bound of the bucket it falls in, or the
+        maximum if that's lower.
+
+        Keyword arguments:
+        percent (float) -- the percentile (0-100)
+        """
+
+        if not self.count:
+            return None
+
+        rank = max(1, int(round(self.count * percent / 100.0)))
+        seen = 0
+
+        for (i, count) in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                break
+
+        largest = self.max * 1e6
+        if i == len(BUCKETS):
+            return largest
+
+        return min(BUCKETS[i], largest)
+
+    def todict(self):
+        "Return the stats as a dict of plain values (in microseconds)."
+
+        return {
+            'count': self.count,
+            'total_us': self.total * 1e6,
+            'mean_us': (self.total / self.count) * 1e6 if self.count else None,
+            'min_us': self.min * 1e6 if self.min is not None else None,
+            'max_us': self.max * 1e6 if self.max is not None else None,
+            'p50_us': self.percentile(50),
+            'p90_us': self.percentile(90),
+            'p99_us': self.percentile(99),
+            'histogram': list(zip(BUCKETS + (None,), self.buckets)),
+        }
+
+class Collector(object):
+    "Collects the measurements of every stage."
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        "Forget every measurement."
+
+        with self._lock:
+            self._stages = dict((stage, StageStats()) for stage in STAGES)
+
+    def record(self, stage, seconds):
+        """Add one measurement.
+
+        Keyword arguments:
+        stage (str) -- one of STAGES
+        seconds (float) -- how long the call took
+        """
+
+        with self._lock:
+            self._stages[stage].add(seconds)
+
+    def snapshot(self):
+        """Return every stage's stats, keyed by stage.
+
+        Each is a dict with 'count', 'total_us', 'mean_us', 'min_us',
+        'max_us', estimated 'p50_us', 'p90_us' and 'p99_us', and the
+        'histogram' as (upper bound in microseconds, count) pairs (the
+        last bound is None).
+        """
+
+        with self._lock:
+            return dict((stage, stats.todict()) for (stage, stats) in self._stages.items())
+
+# Measurements made while enabled
+_collector = Collector()
+_enabled = False
+
+# The number of reasons the wrappers are installed (enable() and each
+# measure() block), and the originals to put back
+_users = 0
+_originals = []
+# (reentrant, since when_imported() calls _imported() straight away if
+# another thread has just imported the module)
+_install_lock = threading.RLock()
+
+# The modules whose functions will be wrapped when they're imported
+_waiting = set()
+
+_hooks = []
+
+# The collectors of measure() blocks, and the stages being timed, in
+# each thread
+_local = threading.local()
+
+def _measuring():
+    "Return whether this thread's calls are being measured."
+
+    return _enabled or bool(getattr(_local, 'collectors', None))
+
+def _record(stage, seconds):
+    if _enabled:
+        _collector.record(stage, seconds)
+
+    for collector in getattr(_local, 'collectors', ()):
+        collector.record(stage, seconds)
+
+    for hook in _hooks:
+        hook(stage, seconds)
+
+def _timed(stage, func):
+    "Wrap a function so every call is measured as part of a stage."
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        # a measure() block in another thread doesn't measure this one
+        if not _measuring():
+            return func(*args, **kwargs)
+
+        active = getattr(_local, 'active', None)
+        if active is None:
+            active = _local.active = set()
+
+        if stage in active:
+            return func(*args, **kwargs)
+
+        active.add(stage)
+        start = default_timer()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = default_timer() - start
+            active.discard(stage)
+            _record(stage, elapsed)
+
+    wrapper._untimed = func
+
+    return wrapper
+
+def _wrap_module(module):
+    "Wrap the functions of every stage in a module."
+
+    for (stage, module_name, class_name, attr) in POINTS:
+        if module_name != module.__name__:
+            continue
+
+        owner = module
+        if class_name is not None:
+            owner = getattr(owner, class_name)
+            # the plain function, not an unbound method
+            original = owner.__dict__[attr]
+        else:
+            original = getattr(owner, attr)
+
+        # a module imported while measuring has imported the wrappers
+        # of other modules' functions
+        original = getattr(original, '_untimed', original)
+
+        _originals.append((owner, attr, original))
+        setattr(owner, attr, _timed(stage, original))
+
+def _imported(module):
+    "Wrap a module that's been imported while the wrappers are installed."
+
+    with _install_lock:
+        if module.__name__ in _waiting:
+            _waiting.remove(module.__name__)
+            _wrap_module(module)
+
+def _install():
+    # modules that aren't imported yet are wrapped when they are, so
+    # measuring doesn't import them (and time importing them)
+    try:
+        for module_name in sorted(set(point[1] for point in POINTS)):
+            if module_name in sys.modules:
+                _wrap_module(sys.modules[module_name])
+            else:
+                _waiting.add(module_name)
+                when_imported(module_name, _imported)
+    except Exception:
+        # don't leave some of them wrapped
+        _uninstall()
+        raise
+
+def _uninstall():
+    while _waiting:
+        remove_import_hook(_waiting.pop(), _imported)
+
+    while _originals:
+        (owner, attr, original) = _originals.pop()
+        setattr(owner, attr, original)
+
+def _acquire():
+    global _users
+
+    with _install_lock:
+        if _users == 0:
+            _install()
+        _users += 1
+
+def _release():
+    global _users
+
+    with _install_lock:
+        _users -= 1
+        if _users == 0:
+            _uninstall()
+
+def enable():
+    "Start measuring every stage (in every thread)."
+
+    global _enabled
+
+    if not _enabled:
+        _acquire()
+        _enabled = True
+
+def disable():
+    "Stop measuring. The measurements are kept until reset()."
+
+    global _enabled
+
+    if _enabled:
+        _enabled = False
+        _release()
+
+def is_enabled():
+    "Return whether enable() is in effect."
+
+    return _enabled
+
+def reset():
+    "Forget everything measured while enabled."
+
+    _collector.reset()
+
+def snapshot():
+    "Return what's been measured while enabled (see Collector.snapshot())."
+
+    return _collector.snapshot()
+
+@contextmanager
+def measure():
+    """Measure the stages run by this thread inside a `with` block.
+
+    Yields a Collector of just the block's measurements. It works
+    whether or not enable() is in effect, and blocks can be nested.
+    """
+
+    collector = Collector()
+    collectors = getattr(_local, 'collectors', None)
+    if collectors is None:
+        collectors = _local.collectors = []
+
+    _acquire()
+    collectors.append(collector)
+    try:
+        yield collector
+    finally:
+        collectors.remove(collector)
+        _release()
+
+def add_hook(hook):
+    """Call a function with every measurement.
+
+    The hook is called as hook(stage, seconds) by the thread that
+    made the measurement, whenever stages are measured: while enabled,
+    or in a thread that's inside a measure() block. It should be
+    quick.
+
+    Keyword arguments:
+    hook (function) -- the function to call
+    """
+
+    _hooks.append(hook)
+
+def remove_hook(hook):
+    """Stop calling a hook added with add_hook().
+
+    Keyword arguments:
+    hook (function) -- the function to stop calling
+    """
+
+    _hooks.remove(hook)
@@ -9,9 +9,9 @@ Note about BitStructs: it appears Construct has some odd formatting, so
 the bit order is reversed when declaring BitStructs. This should be
 noticeable for ribbons.
 
-Note about nickname and ot_name: We have to do some additional logic
-to convert the Pokémon characters into Unicode character, so each byte
-is returned as a node in a list.
+Note about nickname and ot_name: Pokémon characters are converted to
+and from Unicode with the 'pkm-gen4' codec (see pypkm.textcodec), so
+the raw character data is handed to the adapters as a string.
 """
 
 __author__ = 'Patrick Jacobs <ceolwulf@gmail.com>'
@@ -180,7 +180,7 @@ _blockB = Struct('_blockB',
 )
 
 _blockC = Struct('_blockC',
-    NicknameAdapter(StrictRepeater(11, ULInt16('nickname'))),
+    NicknameAdapter(Bytes('nickname', 22)),
     Padding(1),
     ULInt8('hometown'),
     Swapped(BitStruct('sinnoh_ribbons_set3',
@@ -212,7 +212,7 @@ _blockC = Struct('_blockC',
 )
 
 _blockD = Struct('_blockD',
-    OTNameAdapter(StrictRepeater(8, ULInt16('ot_name'))),
+    OTNameAdapter(Bytes('ot_name', 16)),
     Struct('egg_date',
         ULInt8('year'), # minus 2000
         ULInt8('month'),
@@ -276,6 +276,20 @@ pkm_party_struct = Struct('pkm_party_struct',
     Embed(_blockE),
 )
 
+# The offset of each block, so that a single block can be parsed
+# without parsing the whole struct
+pkm_blocks = (
+    (0x00, _block0),
+    (0x08, _blockA),
+    (0x28, _blockB),
+    (0x48, _blockC),
+    (0x68, _blockD),
+)
+
+pkm_party_blocks = pkm_blocks + (
+    (0x88, _blockE),
+)
+
 # Data sent from the GTS server to the client
 pkm_gtsserver_struct = Struct('pkm_gtsserver_struct',
     Bytes('encrypted_pkm', 236),
@@ -310,7 +324,7 @@ pkm_gtsserver_struct = Struct('pkm_gtsserver_struct',
         Padding(1),
     ),
     ULInt32('pv'),
-    OTNameAdapter(StrictRepeater(8, ULInt16('ot_name'))),
+    OTNameAdapter(Bytes('ot_name', 16)),
     ULInt16('ot_id'),
     ULInt8('country'),
     ULInt8('city'),
@@ -355,7 +369,7 @@ pkm_gtsclient_struct = Struct('pkm_gtsclient_struct',
         Padding(1),
     ),
     ULInt32('pv'),
-    OTNameAdapter(StrictRepeater(8, ULInt16('ot_name'))),
+    OTNameAdapter(Bytes('ot_name', 16)),
     ULInt16('ot_id'),
     ULInt8('country'),
     ULInt8('city'),
@@ -264,6 +264,20 @@ pkm_party_struct = Struct('pkm_party_struct',
     Embed(_blockE),
 )
 
+# The offset of each block, so that a single block can be parsed
+# without parsing the whole struct
+pkm_blocks = (
+    (0x00, _block0),
+    (0x08, _blockA),
+    (0x28, _blockB),
+    (0x48, _blockC),
+    (0x68, _blockD),
+)
+
+pkm_party_blocks = pkm_blocks + (
+    (0x88, _blockE),
+)
+
 # Data sent from the GTS server to the client
 pkm_gtsserver_struct = Struct('pkm_gtsserver_struct',
     Bytes('encrypted_pkm', 220),
@@ -0,0 +1,108 @@
+# coding=utf-8
+
+"""The Generation 4 character encoding as a Python codec.
+
+Gen 4 games store text as 16-bit little-endian ordinals into their own
+character table, terminated by 0xFFFF. Importing this module registers
+the table with the `codecs` machinery, so whole strings can be
+converted in one call:
+
+    >>> u'PIKACHU'.encode('pkm-gen4')
+    >>> data.decode('pkm-gen4')
+
+The lookup tables are built from the PyPKM database the first time the
+codec is used: a flat 65,536-entry list for decoding and a dict for
+encoding.
+"""
+
+__author__ = "Patrick Jacobs <ceolwulf@gmail.com>"
+
+import codecs
+import struct
+import sys
+from array import array
+from pypkm.sqlite import get_refdata
+
+NAME = 'pkm-gen4'
+TERMINATOR = 0xFFFF
+
+_decode_table = None
+
+def get_decode_table():
+    """Return the ordinal -> character list, building it on first use.
+
+    Ordinals that aren't in the character table decode to an empty
+    string, just like sqlite.get_chr().
+    """
+
+    global _decode_table
+
+    if _decode_table is None:
+        table = [u''] * 0x10000
+        for (ord_, chr_) in get_refdata().characters.items():
+            table[ord_] = chr_
+        _decode_table = table
+
+    return _decode_table
+
+def encode(input, errors='strict'):
+    """Convert a unicode string to Gen 4 character data.
+
+    Keyword arguments:
+    input (unicode) -- the string to encode
+    errors (str) -- 'strict', 'ignore' or 'replace'
+    """
+
+    ordinals = get_refdata().ordinals
+    ords = []
+
+    for (i, chr_) in enumerate(input):
+        ord_ = ordinals.get(chr_)
+        if ord_ is None:
+            if errors == 'ignore':
+                continue
+            elif errors == 'replace':
+                ord_ = ordinals[u'?']
+            else:
+                raise UnicodeEncodeError(NAME, input, i, i + 1,
+                                         'character not in the gen 4 character table')
+        ords.append(ord_)
+
+    return (struct.pack('<{}H'.format(len(ords)), *ords), len(input))
+
+def decode(input, errors='strict'):
+    """Convert Gen 4 character data to a unicode string.
+
+    Decoding stops at the first terminator, and a trailing odd byte is
+    ignored.
+
+    Keyword arguments:
+    input (str) -- the character data to decode
+    errors (str) -- unused; every ordinal decodes to something
+    """
+
+    data = input
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+
+    words = array('H')
+    words.fromstring(data[:(len(data) - (len(data) % 2))])
+    if sys.byteorder == 'big':
+        words.byteswap()
+
+    if TERMINATOR in words:
+        words = words[:words.index(TERMINATOR)]
+
+    table = get_decode_table()
+
+    return (u''.join([table[ord_] for ord_ in words]), len(input))
+
+def search(name):
+    "Find the Gen 4 codec for codecs.lookup()."
+
+    if name.replace('_', '-') != NAME:
+        return None
+
+    return codecs.CodecInfo(encode=encode, decode=decode, name=NAME)
+
+codecs.register(search)
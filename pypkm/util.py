@@ -1,7 +1,16 @@
 # coding=utf-8
 
-from construct import Buffered
+import struct
+from construct import Buffered, Struct
 from math import floor
+from pypkm.lazy import lazy_import
+
+# NumPy (if it's installed) is only imported when a batch function
+# first uses it
+numpy = lazy_import('numpy', optional=True)
+
+# The order of the stats in every IV, EV, base stat and battle stat row
+STATS = ('hp', 'attack', 'defense', 'speed', 'spattack', 'spdefense')
 
 # http://construct.wikispaces.com/bitfields
 # used for IVs (and maybe ribbon sets) since they span two bytes
@@ -31,6 +40,26 @@ def safe_str(obj):
         # obj is unicode
         return unicode(obj).encode('unicode_escape')
 
+def field_names(strc):
+    """List the names of a Struct's fields, including embedded ones.
+
+    Keyword arguments:
+    strc (construct.Struct) -- the struct to list
+    """
+
+    names = []
+
+    for subcon in strc.subcons:
+        if subcon.conflags & subcon.FLAG_EMBED:
+            # dig through adapters (like Swapped) to the embedded struct
+            while not isinstance(subcon, Struct):
+                subcon = subcon.subcon
+            names.extend(field_names(subcon))
+        elif subcon.name is not None:
+            names.append(subcon.name)
+
+    return names
+
 def calcstat(iv, ev, base, level, nature_stat):
     """Calculate the battle stat of a Pokémon.
 
@@ -63,9 +92,107 @@ def calcstat(iv, ev, base, level, nature_stat):
 
         return int(floor(floor(stat) * nature_stat))
 
+def _nature_tenths():
+    """Return each nature's stat multipliers in tenths, as integers.
+
+    The row for a nature ID has a (neutral) multiplier for HP first, so
+    it lines up with a row of stats.
+    """
+
+    from pypkm.sqlite import get_nature
+
+    return [(10,) + tuple(int(round(m * 10)) for m in get_nature(i)[2:])
+            for i in range(25)]
+
+def _stat_inputs(records):
+    """Gather calcstats_batch()'s arguments from PKM records.
+
+    Keyword arguments:
+    records (iterable) -- PKM objects or decrypted PKM data
+    """
+
+    from pypkm.sqlite import get_basestats, get_level
+
+    (ivs, evs, base, levels, natures) = ([], [], [], [], [])
+
+    for record in records:
+        if hasattr(record, 'tostring'):
+            (pv, pokemon_id, exp) = (record.pv, record.id, record.exp)
+            ivs.append([getattr(record.ivs, stat) for stat in STATS])
+            evs.append([getattr(record.evs, stat) for stat in STATS])
+        else:
+            # the fields are at the same offsets in gen 4 and gen 5
+            (pv,) = struct.unpack_from('<L', record, 0x00)
+            (pokemon_id,) = struct.unpack_from('<H', record, 0x08)
+            (exp,) = struct.unpack_from('<L', record, 0x10)
+            evs.append(struct.unpack_from('<6B', record, 0x18))
+            (iv_data,) = struct.unpack_from('<L', record, 0x38)
+            ivs.append([(iv_data >> (5 * i)) & 0x1F for i in range(6)])
+
+        base.append(get_basestats(pokemon_id))
+        levels.append(get_level(pokemon_id=pokemon_id, exp=exp))
+        natures.append(pv % 25)
+
+    return (ivs, evs, base, levels, natures)
+
+def calcstats_batch(ivs, evs=None, base=None, levels=None, natures=None):
+    """Calculate the battle stats of many Pokémon at once.
+
+    The results are the same as calcstat()'s, but are worked out with
+    integer arithmetic (vectorized when NumPy is installed). Each row
+    of stats is in the order of STATS.
+
+    If only the first argument is given, it's taken as a sequence of
+    PKM objects or decrypted PKM data, and the IVs, EVs, base stats,
+    levels and natures are read from them.
+
+    Returns an N x 6 NumPy array of integers, or a list of tuples
+    without NumPy.
+
+    Keyword arguments:
+    ivs (sequence) -- N rows of 6 IVs (or the PKM records)
+    evs (sequence) -- N rows of 6 EVs
+    base (sequence) -- N rows of 6 base stats
+    levels (sequence) -- N levels (1-100)
+    natures (sequence) -- N nature IDs (0-24)
+    """
+
+    if evs is None:
+        (ivs, evs, base, levels, natures) = _stat_inputs(ivs)
+
+    tenths = _nature_tenths()
+
+    # with ev / 4.0 as in calcstat(), every stat starts with
+    # floor((4 * (iv + 2 * base) + ev) * level / 400), and HP adds
+    # another level (the +100 inside its product) before its +10
+    if numpy is not None:
+        ivs = numpy.asarray(ivs, dtype=numpy.int64).reshape(-1, 6)
+        evs = numpy.asarray(evs, dtype=numpy.int64).reshape(-1, 6)
+        base = numpy.asarray(base, dtype=numpy.int64).reshape(-1, 6)
+        levels = numpy.asarray(levels, dtype=numpy.int64).reshape(-1, 1)
+        multipliers = numpy.asarray(tenths, dtype=numpy.int64)[numpy.asarray(natures, dtype=numpy.intp)]
+
+        stats = ((4 * (ivs + 2 * base)) + evs) * levels // 400
+        hp = stats[:, 0] + levels[:, 0] + 10
+        stats = (stats + 5) * multipliers // 10
+        stats[:, 0] = hp
+
+        return stats
+
+    rows = []
+
+    for (iv_row, ev_row, base_row, level, nature) in zip(ivs, evs, base, levels, natures):
+        stats = [((4 * (iv + 2 * b)) + ev) * level // 400
+                 for (iv, ev, b) in zip(iv_row, ev_row, base_row)]
+        rows.append(tuple([stats[0] + level + 10] + [
+            (stat + 5) * m // 10 for (stat, m) in zip(stats[1:], tenths[nature][1:])
+        ]))
+
+    return rows
+
 class LengthError(Exception):
 
-    def __init__(self, expected_length, given_length, Errors):
+    def __init__(self, expected_length, given_length, Errors=None):
         message = 'expected {}, received {}'
         message = message.format(expected_length, given_length)
 
@@ -20,6 +20,7 @@ setup(
     packages=find_packages(),
     package_data={'': ['data']},
     install_requires=['construct==2.06'],
+    extras_require={'numpy': ['numpy']},
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Intended Audience :: Developers",
@@ -0,0 +1,161 @@
+# coding=utf-8
+
+"""Check that compiled codecs parse and build exactly like Construct.
+
+Every struct and block of both generations is tried with random
+buffers and with real records (box, party and GTS data).
+
+Usage:
+    python -m unittest discover tests
+"""
+
+__author__ = 'Patrick Jacobs <ceolwulf@gmail.com>'
+
+import random
+import unittest
+import pypkm
+from pypkm.compiler import compile_struct
+from pypkm.sqlite import get_refdata
+from pypkm.structs import gen4, gen5
+from pypkm.util import STATS
+
+STRUCTS = {4: gen4, 5: gen5}
+
+# The highest national dex ID of each generation
+MAX_SPECIES = {4: 493, 5: 649}
+NAMES = ('pkm_struct', 'pkm_party_struct', 'pkm_gtsserver_struct', 'pkm_gtsclient_struct')
+
+# The number of random buffers tried for each struct and block
+RANDOM_BUFFERS = 200
+
+def random_buffers(size, seed):
+    "Return repeatable random buffers of a given size."
+
+    rand = random.Random(seed)
+
+    return [''.join(chr(rand.getrandbits(8)) for i in range(size))
+            for j in range(RANDOM_BUFFERS)]
+
+def box_records(gen, count, seed):
+    """Return box records with random (but repeatable) species,
+    experience, PV, trainer and IVs.
+
+    Keyword arguments:
+    gen (int) -- the game generation
+    count (int) -- the number of records
+    seed (int) -- the random seed
+    """
+
+    rand = random.Random(seed)
+    growth_rates = get_refdata().growth_rates
+    # toparty() needs a growth rate for the species
+    species = [i for i in range(1, MAX_SPECIES[gen] + 1) if growth_rates.get(i) is not None]
+    records = []
+
+    for i in range(count):
+        obj = pypkm.new(gen)
+        obj.pv = rand.getrandbits(32)
+        obj.id = rand.choice(species)
+        obj.exp = rand.randint(0, 1000000)
+        obj.ot_id = rand.getrandbits(16)
+        obj.ot_secret_id = rand.getrandbits(16)
+        for stat in STATS:
+            setattr(obj.ivs, stat, rand.randint(0, 31))
+        records.append(obj.tostring())
+
+    return records
+
+def corpus(gen, count=20, seed=0):
+    """Return real records of every kind, keyed by struct name.
+
+    Keyword arguments:
+    gen (int) -- the game generation
+    count (int) -- the number of Pokémon
+    seed (int) -- the random seed
+    """
+
+    records = dict((name, []) for name in NAMES)
+
+    for data in box_records(gen, count, seed):
+        box = pypkm.load(gen, data)
+        party = box.toparty()
+        records['pkm_struct'].append(data)
+        records['pkm_party_struct'].append(party.tostring())
+        records['pkm_gtsserver_struct'].append(party.togtsserver().tostring())
+        records['pkm_gtsclient_struct'].append(party.togtsclient().tostring())
+
+    return records
+
+class CompilerTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.corpora = dict((gen, corpus(gen)) for gen in STRUCTS)
+
+    def assertParity(self, strc, buffers):
+        "Check parse() and build() of a struct against its compiled codec."
+
+        codec = compile_struct(strc)
+        self.assertEqual(codec.sizeof(), strc.sizeof())
+
+        for data in buffers:
+            expected = strc.parse(data)
+            parsed = codec.parse(data)
+            self.assertEqual(parsed, expected)
+
+            try:
+                built = strc.build(expected)
+            except Exception:
+                # the compiled codec has to refuse it too
+                self.assertRaises(Exception, codec.build, expected)
+                continue
+
+            self.assertEqual(codec.build(expected), built)
+
+    def check_struct(self, gen, name):
+        strc = getattr(STRUCTS[gen], name)
+        buffers = random_buffers(strc.sizeof(), seed=hash((gen, name)))
+        buffers.extend(self.corpora[gen][name])
+
+        self.assertParity(strc, buffers)
+
+    def check_blocks(self, gen, blocks_name, name):
+        for (offset, block) in getattr(STRUCTS[gen], blocks_name):
+            size = block.sizeof()
+            buffers = random_buffers(size, seed=hash((gen, blocks_name, offset)))
+            buffers.extend(data[offset:(offset + size)] for data in self.corpora[gen][name])
+
+            self.assertParity(block, buffers)
+
+    def test_gen4_pkm_struct(self):
+        self.check_struct(4, 'pkm_struct')
+
+    def test_gen4_pkm_party_struct(self):
+        self.check_struct(4, 'pkm_party_struct')
+
+    def test_gen4_pkm_gtsserver_struct(self):
+        self.check_struct(4, 'pkm_gtsserver_struct')
+
+    def test_gen4_pkm_gtsclient_struct(self):
+        self.check_struct(4, 'pkm_gtsclient_struct')
+
+    def test_gen4_pkm_blocks(self):
+        self.check_blocks(4, 'pkm_party_blocks', 'pkm_party_struct')
+
+    def test_gen5_pkm_struct(self):
+        self.check_struct(5, 'pkm_struct')
+
+    def test_gen5_pkm_party_struct(self):
+        self.check_struct(5, 'pkm_party_struct')
+
+    def test_gen5_pkm_gtsserver_struct(self):
+        self.check_struct(5, 'pkm_gtsserver_struct')
+
+    def test_gen5_pkm_gtsclient_struct(self):
+        self.check_struct(5, 'pkm_gtsclient_struct')
+
+    def test_gen5_pkm_blocks(self):
+        self.check_blocks(5, 'pkm_party_blocks', 'pkm_party_struct')
+
+if __name__ == '__main__':
+    unittest.main()